@@ -0,0 +1,34 @@
+#!/usr/bin/python
+# Copyright (c) 2015 Red Hat, Inc. All rights reserved.
+#
+# This copyrighted material is made available to anyone wishing
+# to use, modify, copy, or redistribute it subject to the terms
+# and conditions of the GNU General Public License version 2.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program; if not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+
+""" Reading the nexus conf. Kept free of heavy imports, the CLI loads it
+before it knows which command runs. """
+
+import ConfigParser
+
+class Conf_ini(ConfigParser.ConfigParser):
+    def conf_to_dict(self):
+        """
+        Reading a config file into a dictionary.
+
+        In config, you all the items in dictionary, the issue is that you can't
+        use it as is. The default data structure is OrderedDict. The k holds the
+        section name. The next code creates a dictionary based on _defaults
+        OrderedDict(). And for the **d[k], it means that d[k] (dictionary) is
+        decomposed into assignments. This is necessary as the dict() method
+        requires assignments as additional parameters to the method.
+        """
+        d = dict(self._sections)
+        for k in d:
+            d[k] = dict(self._defaults, **d[k])
+            d[k].pop('__name__', None)
+        return d
@@ -0,0 +1,338 @@
+#!/usr/bin/python
+# Copyright (c) 2015 Red Hat, Inc. All rights reserved.
+#
+# This copyrighted material is made available to anyone wishing
+# to use, modify, copy, or redistribute it subject to the terms
+# and conditions of the GNU General Public License version 2.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program; if not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+
+"""
+Parallel HTTP downloads of build artifacts.
+
+Files are fetched on a bounded WorkerPool, largest first, and every worker
+keeps its own requests.Session so connections to a server are reused across
+files. Progress and throughput are logged for the whole set rather than per
+file. With a [cache] cache_dir in the conf, files already in the rpm cache
+are taken from it and new ones are added to it.
+
+A file is written to dest.part and only renamed to dest once it has been
+verified, against the rpm payload hash from the hub when known and its size
+otherwise. An interrupted transfer is resumed from the end of the .part file
+with an HTTP Range request.
+
+A Download may name a local path holding the same file, such as the brew or
+errata tree mounted over NFS. When that path exists the file is hardlinked,
+reflinked or copied from it in the kernel, on the same workers as the
+downloads and verified the same way. Files missing from it or failing
+verification are fetched over HTTP.
+"""
+
+import os
+import time
+import struct
+import hashlib
+import threading
+import requests
+from nexus.lib import logger
+from nexus.lib.rpmcache import RPMCache
+from nexus.lib.rpmcache import url_key
+from nexus.lib.rpmcache import rpm_key
+from nexus.lib.rpmcache import link_or_copy
+from nexus.lib.factory import WorkerPool
+from nexus.lib.factory import max_workers
+from nexus.lib.factory import backoff_delay
+from nexus.lib.factory import DEFAULT_MAX_WORKERS
+
+CHUNK_SIZE = 65536
+DEFAULT_TIMEOUT = 60
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 2.0
+PROGRESS_INTERVAL = 10
+
+RPM_LEAD_SIZE = 96
+RPM_HEADER_MAGIC = '\x8e\xad\xe8'
+
+class ChecksumError(IOError):
+    """ Raised when a downloaded file does not match its size or hash. """
+
+def sigmd5(path):
+    """
+    MD5 of the header and payload of the rpm at path, what koji reports as
+    payloadhash. It skips the lead and the signature header, so it does not
+    change when the rpm is signed.
+    """
+    with open(path, 'rb') as f:
+        f.seek(RPM_LEAD_SIZE)
+        intro = f.read(16)
+        if len(intro) < 16 or intro[:3] != RPM_HEADER_MAGIC:
+            raise ChecksumError("%s is not an rpm" % path)
+        count, size = struct.unpack('>II', intro[8:16])
+        length = 16 + 16 * count + size
+        # the signature header is padded to a multiple of 8 bytes
+        f.seek(RPM_LEAD_SIZE + length + (8 - length % 8) % 8)
+        md5 = hashlib.md5()
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+def verify(path, size=None, payloadhash=None):
+    """ Raise ChecksumError unless the file at path has the given payload
+    hash, or if there is none, the given size. """
+    if payloadhash:
+        digest = sigmd5(path)
+        if digest != payloadhash:
+            raise ChecksumError("%s: payload hash %s, expected %s" % \
+                                (path, digest, payloadhash))
+    elif size is not None and os.path.getsize(path) != size:
+        raise ChecksumError("%s: %d bytes, expected %d" % \
+                            (path, os.path.getsize(path), size))
+
+def _total_size(response):
+    """ Size of the whole file from a 200 or 206 response, if given. """
+    if response.status_code == 206:
+        total = response.headers.get('Content-Range', '').rpartition('/')[2]
+    else:
+        total = response.headers.get('Content-Length', '')
+    return int(total) if total.isdigit() else None
+
+def _fetch_part(session, url, part, timeout, on_data):
+    """ Append the rest of url to part. Returns the size of the whole file
+    if the server told it. """
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    headers = {'Range': 'bytes=%d-' % offset} if offset else {}
+    response = session.get(url, stream=True, timeout=timeout, headers=headers)
+    try:
+        if response.status_code == 416 and offset:
+            # nothing left to fetch, the part is the whole file
+            return None
+        response.raise_for_status()
+        if response.status_code == 206:
+            logger.log.info("Resuming %s at byte %d" % (url, offset))
+            mode = 'ab'
+        else:
+            mode = 'wb'
+        with open(part, mode) as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                if on_data is not None:
+                    on_data(len(chunk))
+        return _total_size(response)
+    finally:
+        response.close()
+
+def fetch_file(url, dest, size=None, payloadhash=None, session=None,
+               timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, on_data=None):
+    """
+    Download url to dest through dest.part, resuming the .part left by an
+    earlier attempt. Transfer errors are retried up to retries times with
+    backoff; a file failing verification is fetched again from scratch.
+    on_data is called with the size of every chunk received. Returns the
+    size of dest.
+    """
+    session = session or requests
+    part = dest + '.part'
+    attempt = 0
+    while True:
+        try:
+            total = _fetch_part(session, url, part, timeout, on_data)
+            if total is not None and os.path.getsize(part) < total:
+                # a short read, keep the part and resume from where it ended
+                raise IOError("transfer ended at byte %d of %d" % \
+                              (os.path.getsize(part), total))
+            verify(part, size if size is not None else total, payloadhash)
+            break
+        except (IOError, requests.RequestException) as e:
+            response = getattr(e, 'response', None)
+            if response is not None and 400 <= response.status_code < 500:
+                raise
+            if isinstance(e, ChecksumError) and os.path.exists(part):
+                os.unlink(part)
+            if attempt >= retries:
+                raise
+            delay = backoff_delay(attempt, DEFAULT_BACKOFF)
+            attempt += 1
+            logger.log.warn("%s: %s, retry %d of %d in %.1fs" % \
+                            (url, e, attempt, retries, delay))
+            time.sleep(delay)
+    # rename, never write, over dest: it may be a hardlink into the rpm cache
+    os.rename(part, dest)
+    return os.path.getsize(dest)
+
+class Download(object):
+    """ One file to fetch from url into dest. size is the expected size in
+    bytes if known, it is used to order the downloads and verify them along
+    with payloadhash. key identifies the file in the rpm cache and defaults
+    to one derived from url. local is a path the same file may be found at
+    on this machine. """
+
+    def __init__(self, url, dest, size=None, key=None, payloadhash=None,
+                 local=None):
+        self.url = url
+        self.dest = dest
+        self.size = size
+        self.payloadhash = payloadhash
+        self.key = key or url_key(url)
+        self.local = local
+        self.cached = False
+        self.copied = None
+        self.fetched = 0
+        self.wall_time = 0.0
+
+    def __repr__(self):
+        return "<Download %s>" % self.url
+
+class Progress(object):
+    """ Aggregate progress of a set of downloads, logged at most every
+    PROGRESS_INTERVAL seconds. """
+
+    def __init__(self, downloads):
+        self.files = len(downloads)
+        self.total = sum(d.size or 0 for d in downloads)
+        self.done = 0
+        self.size = 0
+        self.start = time.time()
+        self.last = self.start
+        self.lock = threading.Lock()
+
+    def update(self, size, finished=False):
+        with self.lock:
+            self.size += size
+            if finished:
+                self.done += 1
+            now = time.time()
+            if now - self.last < PROGRESS_INTERVAL:
+                return
+            self.last = now
+        self.log()
+
+    def rate(self):
+        elapsed = time.time() - self.start
+        return self.size / elapsed / 1048576 if elapsed > 0 else 0
+
+    def log(self):
+        if self.total:
+            of = " of %.1f MB" % (self.total / 1048576.0)
+        else:
+            of = ""
+        logger.log.info("Downloaded %d of %d files, %.1f MB%s (%.2f MB/s)" % \
+                        (self.done, self.files, self.size / 1048576.0, of,
+                         self.rate()))
+
+class Downloader(object):
+    """
+    Fetches lists of Downloads with at most max_workers transfers at a
+    time. The first failed download cancels the ones not started yet and
+    is raised from fetch_all().
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, timeout=DEFAULT_TIMEOUT,
+                 cache=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cache = cache
+        self.local = threading.local()
+
+    @classmethod
+    def from_conf(cls, conf_dict, stage):
+        """ Downloader with the worker count of stage in the [concurrency]
+        section of the conf and the rpm cache of its [cache] section. """
+        return cls(max_workers(conf_dict, stage),
+                   cache=RPMCache.from_conf(conf_dict))
+
+    def session(self):
+        """ requests.Session of the calling worker thread. """
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def fetch(self, download, progress):
+        start = time.time()
+        if self.from_local(download):
+            download.wall_time = time.time() - start
+            progress.update(os.path.getsize(download.dest), finished=True)
+            logger.log.debug("Copied %s from %s (%s in %.2fs)" % \
+                             (download.dest, download.local, download.copied,
+                              download.wall_time))
+            return download
+        download.fetched = fetch_file(download.url, download.dest,
+                                      download.size, download.payloadhash,
+                                      self.session(), self.timeout,
+                                      on_data=progress.update)
+        download.wall_time = time.time() - start
+        if self.cache is not None:
+            self.cache.store(download.key, download.dest)
+        progress.update(0, finished=True)
+        logger.log.debug("Downloaded %s (%d bytes in %.2fs)" % \
+                         (download.url, download.fetched, download.wall_time))
+        return download
+
+    def fetch_all(self, downloads):
+        """ Fetch downloads not in the rpm cache, largest first, copying
+        those found at their local path and downloading the rest. Returns
+        them in the order given. """
+        missing = [d for d in downloads if not self.from_cache(d)]
+        if len(missing) < len(downloads):
+            logger.log.info("%d of %d files taken from the rpm cache" % \
+                            (len(downloads) - len(missing), len(downloads)))
+        if missing:
+            ordered = sorted(missing, key=lambda d: d.size or 0, reverse=True)
+            progress = Progress(missing)
+            logger.log.info("Downloading %d files with %d workers" % \
+                            (len(missing), self.max_workers))
+            pool = WorkerPool(self.max_workers, fail_fast=True)
+            try:
+                pool.map(self.fetch, ordered, progress)
+            finally:
+                pool.shutdown()
+            progress.log()
+            copied = len([d for d in missing if d.copied])
+            if copied:
+                logger.log.info("%d of %d files copied from local paths" % \
+                                (copied, len(downloads)))
+        if self.cache is not None:
+            self.cache.evict()
+        return downloads
+
+    def from_cache(self, download):
+        if self.cache is None:
+            return False
+        download.cached = self.cache.materialize(download.key, download.dest)
+        return download.cached
+
+    def from_local(self, download):
+        """ Put the file at the local path of download at its dest, if it
+        is there and verifies like a download would. Returns False if it
+        has to be downloaded instead. """
+        if not download.local or not os.path.isfile(download.local):
+            return False
+        part = download.dest + '.part'
+        try:
+            how = link_or_copy(download.local, part)
+            verify(part, download.size, download.payloadhash)
+        except (IOError, OSError) as e:
+            logger.log.warn("%s: %s, downloading it instead" % (download.local, e))
+            if os.path.exists(part):
+                os.unlink(part)
+            return False
+        os.rename(part, download.dest)
+        download.copied = how
+        return True
+
+def local_path(url, root, local_root):
+    """ Path under local_root of a url under root, None if url is not
+    under root or local_root is not there. """
+    if not local_root or not url.startswith(root) or not os.path.isdir(local_root):
+        return None
+    return local_root.rstrip('/') + '/' + url[len(root):].lstrip('/')
+
+def rpm_download(rpm, dest_dir, local=None):
+    """ Download of a hub rpm dict that has its 'url' into dest_dir,
+    verified by its payload hash and cached by NVRA and payload hash.
+    local is the path it may be copied from instead. """
+    return Download(rpm['url'],
+                    os.path.join(dest_dir, os.path.basename(rpm['url'])),
+                    rpm.get('size'), rpm_key(rpm), rpm.get('payloadhash'), local)
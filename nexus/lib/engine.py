@@ -0,0 +1,274 @@
+#!/usr/bin/python
+# Copyright (c) 2015 Red Hat, Inc. All rights reserved.
+#
+# This copyrighted material is made available to anyone wishing
+# to use, modify, copy, or redistribute it subject to the terms
+# and conditions of the GNU General Public License version 2.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program; if not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+
+"""
+Event driven execution of remote operations.
+
+EventEngine drives many jobs - remote commands and directory pushes - from
+a single thread, sleeping in poll() until one of them can make progress.
+It replaces a worker thread per host for the I/O phase of an operation;
+paramiko still runs one transport thread per SSH connection. Downloads
+are not driven here, they stay on the Downloader's thread pool.
+"""
+
+import os
+import time
+import errno
+import fcntl
+import select
+import subprocess
+import collections
+from nexus.lib import logger
+from nexus.lib.factory import CHANNEL_BUFSIZE
+from nexus.lib.factory import CHANNEL_POLL_TIMEOUT
+from nexus.lib.factory import STREAM_TAIL_LINES
+from nexus.lib.factory import STREAM_MAX_LINE
+
+# How often jobs waiting for an SSH window to open are re-checked. paramiko
+# channels only signal readability to poll().
+SEND_POLL_INTERVAL = 0.05
+
+class Job(object):
+    """
+    One operation driven by EventEngine. Subclasses implement start(),
+    readers(), writers() and step(); step() is called whenever poll()
+    returns and must never block. A job is finished once done is True.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.done = False
+        self.error = None
+        self.start_time = None
+        self.wall_time = 0.0
+
+    def start(self):
+        pass
+
+    def readers(self):
+        return []
+
+    def writers(self):
+        return []
+
+    def sending(self):
+        """ True while the job waits for an SSH window to send data. """
+        return False
+
+    def step(self):
+        pass
+
+    def finish(self, error=None):
+        self.done = True
+        self.error = error
+        self.wall_time = time.time() - self.start_time
+        self.close()
+
+    def close(self):
+        pass
+
+class ChannelJob(Job):
+    """
+    Base for jobs running a command on an SSH channel. Output is split into
+    lines, logged with the hostname and the last lines of each stream are
+    kept for error reports. Data in self.pending is sent to the command's
+    stdin as the SSH window allows.
+    """
+
+    def __init__(self, client, args, tail=STREAM_TAIL_LINES):
+        Job.__init__(self, "%s: %s" % (client.hostname, args))
+        self.client = client
+        self.host = client.hostname
+        self.args = args
+        self.exit_status = None
+        self.stdout_tail = collections.deque(maxlen=tail)
+        self.stderr_tail = collections.deque(maxlen=tail)
+        self.partial = {'stdout': '', 'stderr': ''}
+        self.pending = ''
+        self.input_done = True
+        self.channel = None
+
+    def start(self):
+        self.channel = self.client.get_transport().open_session()
+        self.channel.exec_command(self.args)
+
+    def readers(self):
+        return [self.channel]
+
+    def sending(self):
+        return bool(self.pending)
+
+    def refill(self):
+        """ Hook for subclasses to top up self.pending. """
+
+    def send(self):
+        if not self.pending:
+            self.refill()
+        while self.pending and self.channel.send_ready():
+            sent = self.channel.send(self.pending[:CHANNEL_BUFSIZE])
+            self.pending = self.pending[sent:]
+            if not self.pending:
+                self.refill()
+        if not self.pending and self.input_done and not self.channel.eof_sent:
+            self.channel.shutdown_write()
+
+    def output(self, name, data):
+        lines = (self.partial[name] + data).split('\n')
+        self.partial[name] = lines.pop()
+        if len(self.partial[name]) > STREAM_MAX_LINE:
+            lines.append(self.partial[name])
+            self.partial[name] = ''
+        for line in lines:
+            self.line(name, line.rstrip('\r'))
+
+    def line(self, name, line):
+        if name == 'stdout':
+            self.stdout_tail.append(line)
+            logger.log.info("%s: %s" % (self.host, line))
+        else:
+            self.stderr_tail.append(line)
+            logger.log.warn("%s: %s" % (self.host, line))
+
+    def step(self):
+        channel = self.channel
+        self.send()
+        while channel.recv_ready():
+            self.output('stdout', channel.recv(CHANNEL_BUFSIZE))
+        while channel.recv_stderr_ready():
+            self.output('stderr', channel.recv_stderr(CHANNEL_BUFSIZE))
+        if channel.exit_status_ready() or channel.closed:
+            for name in ('stdout', 'stderr'):
+                if self.partial[name]:
+                    self.line(name, self.partial[name])
+            self.exit_status = channel.recv_exit_status()
+            self.finish()
+
+    def close(self):
+        if self.channel is not None:
+            self.channel.close()
+
+class ExecJob(ChannelJob):
+    """ Run args on the host of client, optionally feeding it stdin. """
+
+    def __init__(self, client, args, stdin=None, tail=STREAM_TAIL_LINES):
+        ChannelJob.__init__(self, client, args, tail)
+        if stdin is not None:
+            self.pending = stdin
+            self.input_done = True
+
+    def start(self):
+        ChannelJob.start(self)
+        if not self.pending:
+            self.channel.shutdown_write()
+
+class PutTreeJob(ChannelJob):
+    """
+    Push the local directory source into destination on the host of client
+    as a tar stream. The stream is produced by a local tar whose pipe is
+    multiplexed with the channel, so no thread is needed per host.
+    """
+
+    def __init__(self, client, source, destination, compress=True):
+        flag = 'z' if compress else ''
+        quoted = "'%s'" % destination.replace("'", "'\\''")
+        ChannelJob.__init__(self, client, "mkdir -p %s && tar -x%sf - -C %s" % \
+                            (quoted, flag, quoted))
+        self.source = source
+        self.flag = flag
+        self.sent = 0
+        self.input_done = False
+        self.tar = None
+
+    def start(self):
+        ChannelJob.start(self)
+        self.tar = subprocess.Popen(['tar', '-c%sf' % self.flag, '-', '-C', self.source, '.'],
+                                    stdout=subprocess.PIPE)
+        fd = self.tar.stdout.fileno()
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    def readers(self):
+        if self.pending or self.input_done:
+            return [self.channel]
+        return [self.channel, self.tar.stdout]
+
+    def refill(self):
+        if self.input_done:
+            return
+        try:
+            data = os.read(self.tar.stdout.fileno(), CHANNEL_BUFSIZE)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            raise
+        if data:
+            self.pending = data
+            self.sent += len(data)
+        else:
+            self.input_done = True
+            if self.tar.wait() != 0:
+                raise IOError("local tar of %s failed" % self.source)
+
+    def close(self):
+        ChannelJob.close(self)
+        if self.tar is not None and self.tar.poll() is None:
+            self.tar.kill()
+            self.tar.wait()
+
+class EventEngine(object):
+    """
+    Drives jobs to completion from the calling thread. A job that raises is
+    finished with the exception stored in job.error; a job still running
+    after timeout seconds is finished with an IOError.
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+
+    def run(self, jobs):
+        active = []
+        for job in jobs:
+            job.start_time = time.time()
+            try:
+                job.start()
+                active.append(job)
+            except Exception as e:
+                job.finish(e)
+
+        while active:
+            # poll() rather than select(), which fails on descriptors past
+            # FD_SETSIZE, a few hundred hosts into a run
+            events = collections.defaultdict(int)
+            for job in active:
+                for fd in job.readers():
+                    events[fd.fileno()] |= select.POLLIN
+                for fd in job.writers():
+                    events[fd.fileno()] |= select.POLLOUT
+            poller = select.poll()
+            for fd, mask in events.items():
+                poller.register(fd, mask)
+            if any(job.sending() for job in active):
+                wait = SEND_POLL_INTERVAL
+            else:
+                wait = CHANNEL_POLL_TIMEOUT
+            poller.poll(wait * 1000)
+
+            now = time.time()
+            for job in active:
+                try:
+                    job.step()
+                    if not job.done and self.timeout and now - job.start_time > self.timeout:
+                        raise IOError("%s timed out after %ss" % (job.name, self.timeout))
+                except Exception as e:
+                    logger.log.error("%s failed: %s" % (job.name, e))
+                    job.finish(e)
+            active = [job for job in active if not job.done]
+        return jobs
@@ -1,59 +1,219 @@
 #!/usr/bin/python
 
-import koji as brew
 import threading
-import ConfigParser
-import json
-import urllib2
 import os
 import paramiko
 import socket
-import argparse
 import StringIO
 import platform
+import atexit
+import select
+import collections
+import Queue
+import sys
+import time
+import uuid
+import base64
+import pipes
+import tarfile
+import random
+from nexus.lib import logger
+# Conf_ini lived here before nexus.lib.conf, keep it importable from factory
+from nexus.lib.conf import Conf_ini
 
 PARAMIKO_VERSION = (int(paramiko.__version__.split('.')[0]), int(paramiko.__version__.split('.')[1]))
 
-class Conf_ini(ConfigParser.ConfigParser):
-    def conf_to_dict(self):
+# Size of a single recv() from a channel and the longest time a reader sleeps
+# in poll() before re-checking the channel state.
+CHANNEL_BUFSIZE = 32768
+CHANNEL_POLL_TIMEOUT = 60
+
+# Number of trailing output lines RemoteStream keeps for error reports and
+# the longest partial line it holds before flushing it as a line of its own.
+STREAM_TAIL_LINES = 100
+STREAM_MAX_LINE = 65536
+
+# Worker threads a WorkerPool starts when nothing else is configured.
+DEFAULT_MAX_WORKERS = 16
+
+# Connection attempts SSHPool makes after the first one fails, and the base
+# delay in seconds of its exponential backoff.
+DEFAULT_CONNECT_RETRIES = 2
+DEFAULT_CONNECT_BACKOFF = 1.0
+DEFAULT_CONNECT_BACKOFF_MAX = 30.0
+
+def max_workers(conf_dict, stage):
+    """
+    Number of concurrent workers for stage, read from the [concurrency]
+    section of the conf. Falls back to its default key and then to
+    DEFAULT_MAX_WORKERS.
+    """
+    section = conf_dict.get('concurrency', {})
+    return int(section.get(stage, section.get('default', DEFAULT_MAX_WORKERS)))
+
+class TaskTimeout(Exception):
+    """ Raised by Future.result() when a task ran longer than its timeout. """
+
+class TaskCancelled(Exception):
+    """ Raised by Future.result() for a task cancelled before it started. """
+
+class Future(object):
+    """
+    Result of a task submitted to a WorkerPool. result() returns the value
+    the task returned or re-raises the exception it raised.
+    """
+
+    def __init__(self, f, args):
+        self.f = f
+        self.args = args
+        self.start_time = None
+        self._started = threading.Event()
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._exc_info = None
+
+    def _run(self):
+        with self._lock:
+            if self._done.is_set():
+                return
+            self.start_time = time.time()
+            self._started.set()
+        try:
+            self._result = self.f(*self.args)
+        except Exception:
+            self._exc_info = sys.exc_info()
+        self._done.set()
+
+    def cancel(self):
+        """ Cancel the task if it has not started yet. Returns True if it
+        was cancelled. """
+        with self._lock:
+            if self._started.is_set() or self._done.is_set():
+                return False
+            self._exc_info = (TaskCancelled, TaskCancelled("task cancelled"), None)
+            self._done.set()
+        return True
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
         """
-        Reading a config file into a dictionary.
-
-        In config, you all the items in dictionary, the issue is that you can't
-        use it as is. The default data structure is OrderedDict. The k holds the
-        section name. The next code creates a dictionary based on _defaults
-        OrderedDict(). And for the **d[k], it means that d[k] (dictionary) is
-        decomposed into assignments. This is necessary as the dict() method
-        requires assignments as additional parameters to the method.
+        Wait for the task to finish. timeout counts from the moment the task
+        started running, not from the time it was queued. Raises TaskTimeout
+        if it is still running after timeout seconds.
         """
-        d = dict(self._sections)
-        for k in d:
-            d[k] = dict(self._defaults, **d[k])
-            d[k].pop('__name__', None)
-        return d
+        if timeout is None:
+            self._done.wait()
+            return
+        while not self._started.wait(1):
+            if self._done.is_set():
+                return
+        remaining = self.start_time + timeout - time.time()
+        if not self._done.wait(max(remaining, 0)):
+            raise TaskTimeout("%s did not finish within %ss" % \
+                              (getattr(self.f, '__name__', self.f), timeout))
+
+    def exception(self, timeout=None):
+        self.wait(timeout)
+        if self._exc_info is not None:
+            return self._exc_info[1]
+        return None
+
+    def result(self, timeout=None):
+        self.wait(timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+class WorkerPool(object):
+    """
+    Runs tasks on at most max_workers threads. Exceptions raised by a task
+    are carried back to the caller by its Future. timeout limits how long a
+    single task may run while gathered by map(); with fail_fast, map()
+    cancels the tasks that have not started yet as soon as one task fails.
+
+    Worker threads are daemons, a task that timed out keeps running in the
+    background but never blocks the process from exiting.
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, timeout=None, fail_fast=False):
+        self.max_workers = max(1, int(max_workers))
+        self.timeout = timeout
+        self.fail_fast = fail_fast
+        self._queue = Queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def _worker(self):
+        while True:
+            future = self._queue.get()
+            if future is None:
+                return
+            future._run()
+
+    def submit(self, f, *args):
+        """ Queue f(*args) and return its Future. """
+        future = Future(f, args)
+        with self._lock:
+            if len(self._workers) < self.max_workers:
+                t = threading.Thread(target=self._worker)
+                t.daemon = True
+                t.start()
+                self._workers.append(t)
+        self._queue.put(future)
+        return future
+
+    def gather(self, futures):
+        """
+        Wait for futures in order and return their results. Re-raises the
+        first exception or TaskTimeout, cancelling the remaining futures
+        first if the pool is fail_fast.
+        """
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result(self.timeout))
+            except Exception:
+                if self.fail_fast:
+                    for f in futures:
+                        f.cancel()
+                raise
+        return results
+
+    def map(self, f, items, *args):
+        """ Call f(item, *args) for every item and return the results. """
+        return self.gather([self.submit(f, item, *args) for item in items])
+
+    def shutdown(self):
+        """ Stop the worker threads once the queued tasks are done. """
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for t in workers:
+            self._queue.put(None)
 
 class Threader(object):
+    """
+    Compatibility wrapper around WorkerPool for callers of the old
+    get_item/gather_results interface. Exceptions raised by f are re-raised
+    by gather_results instead of leaving it waiting forever.
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+        self.pool = WorkerPool(max_workers)
 
     def get_item(self, f, item, conf_dict):
         """
         Function which runs a given function in a thread and stores the result.
         """
-        result_info = [threading.Event(), None]
-        def runit():
-            result_info[1] = f(item, conf_dict)
-            result_info[0].set()
-        threading.Thread(target=runit).start()
-        return result_info
+        return self.pool.submit(f, item, conf_dict)
 
     def gather_results(self, result_info):
         """
         Function to gather the results from get_item.
         """
-        results = []
-        for i in xrange(len(result_info)):
-            result_info[i][0].wait()
-            results.append(result_info[i][1])
-        return results
+        return self.pool.gather(result_info)
 
 class SSHClient(paramiko.SSHClient):
     """ This class Inherits paramiko.SSHClient and implements client.exec_commands
@@ -74,6 +234,9 @@ class SSHClient(paramiko.SSHClient):
         else:
             self.port = port
 
+        self._sftp = None
+        self._sftp_lock = threading.Lock()
+
         paramiko.SSHClient.__init__(self)
         self.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         try:
@@ -81,6 +244,18 @@ class SSHClient(paramiko.SSHClient):
         except (paramiko.AuthenticationException, paramiko.SSHException, socket.error):
             raise
 
+    def is_alive(self):
+        """ Health check used by SSHPool. Returns True if the underlying
+        transport is still active and accepts traffic. """
+        transport = self.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+        except (paramiko.SSHException, EOFError, socket.error):
+            return False
+        return True
+
     def ExecuteCmd(self, args):
         """ This Function executes commands using SSHClient.exec_commands().
         @params: args: Commands that needs to be executed. Commands which have longer
@@ -97,14 +272,17 @@ class SSHClient(paramiko.SSHClient):
         else:
             return stdin, stdout, stderr
 
-    def ExecuteScript(self, args):
+    def ExecuteScript(self, args, on_stdout=None, on_stderr=None):
         """ This Function Executes commands/scripts using channel.exec_command().
         @params args: Commands/scripts that need to be executed.
+        on_stdout, on_stderr: optional callables, called with every chunk of
+        data as soon as it is received from the channel.
         Data received from the command are buffered. """
 
         transport = self.get_transport()
         stdout = StringIO.StringIO()
         stderr = StringIO.StringIO()
+        exit_status = -1
         try:
             channel = transport.open_session()
         except paramiko.SSHException, e:
@@ -116,31 +294,106 @@ class SSHClient(paramiko.SSHClient):
             print "Cannot execute %s", args
             channel.close()
         else:
-            while not channel.exit_status_ready():
-                if channel.recv_ready():
-                    data = channel.recv(1024)
-                    while data:
-                        stdout.write(data)
-                        data = channel.recv(1024)
-                if channel.recv_stderr_ready():
-                    error_buff = channel.recv_stderr(1024)
-                    while error_buff:
-                        stderr.write(error_buff)
-                        error_buff = channel.recv_stderr(1024)
+            for stream, data in self.ReadChannel(channel):
+                if stream == 'stdout':
+                    stdout.write(data)
+                    if on_stdout is not None:
+                        on_stdout(data)
+                else:
+                    stderr.write(data)
+                    if on_stderr is not None:
+                        on_stderr(data)
 
             exit_status = channel.recv_exit_status()
+            channel.close()
 
         return stdout,stderr,exit_status
 
+    def ReadChannel(self, channel, bufsize=CHANNEL_BUFSIZE):
+        """ Generator yielding ('stdout', data) and ('stderr', data) chunks
+        from channel until the remote command exits.
+        The reader sleeps in poll() on the channel between chunks instead of
+        busy looping, so waiting on a long running command costs no CPU.
+        poll() rather than select() keeps working once the process holds more
+        than FD_SETSIZE descriptors. """
+
+        while True:
+            if channel.recv_ready():
+                yield 'stdout', channel.recv(bufsize)
+            elif channel.recv_stderr_ready():
+                yield 'stderr', channel.recv_stderr(bufsize)
+            elif channel.exit_status_ready():
+                return
+            elif channel.eof_received:
+                # Nothing more can arrive after EOF, only the exit status.
+                channel.status_event.wait(CHANNEL_POLL_TIMEOUT)
+            else:
+                poller = select.poll()
+                poller.register(channel, select.POLLIN)
+                poller.poll(CHANNEL_POLL_TIMEOUT * 1000)
+
+    def StreamScript(self, args, tail=STREAM_TAIL_LINES, stdin=None):
+        """ Returns a RemoteStream for args. Iterating over it runs the
+        command and yields (hostname, stream, line) tuples as lines arrive.
+        stdin: optional data written to the command's standard input.
+        """
+        return RemoteStream(self, args, tail, stdin)
+
+    def ExecuteLogged(self, args, tail=STREAM_TAIL_LINES, stdin=None):
+        """ Runs args and logs every line of its output, tagged with the
+        hostname, as soon as it is received. stderr lines are logged as
+        warnings. Returns the finished RemoteStream, which holds the exit
+        status and the last lines of stdout and stderr. """
+        stream = self.StreamScript(args, tail, stdin)
+        for host, name, line in stream:
+            if name == 'stdout':
+                logger.log.info("%s: %s" % (host, line))
+            else:
+                logger.log.warn("%s: %s" % (host, line))
+        return stream
+
+    def ExecuteBatch(self, steps, stop_on_error=False, tail=STREAM_TAIL_LINES):
+        """ Runs a list of steps in a single remote shell, in one round trip.
+        @params steps: shell commands (strings) or FileStep objects.
+        stop_on_error: do not run the steps following a failed one.
+        Output is logged live, tagged with the hostname. Returns a
+        StepResult for every step, steps that were not run have an
+        exit_status of None. """
+        batch = Batch(steps, stop_on_error)
+        results = batch.results(tail)
+        current = {'stdout': None, 'stderr': None}
+        for host, name, line in self.StreamScript(batch.shell, tail, batch.script()):
+            line, step = batch.parse_marker(line)
+            if line:
+                if current[name] is not None:
+                    getattr(results[current[name]], name + '_tail').append(line)
+                if name == 'stdout':
+                    logger.log.info("%s: %s" % (host, line))
+                else:
+                    logger.log.warn("%s: %s" % (host, line))
+            if step is not None:
+                current[name] = step
+        batch.collect(results)
+        return results
+
+    def GetSFTP(self):
+        """ Returns the SFTP session of this connection, opening it on first
+        use and again if the transport it ran on is gone. Callers must hold
+        _sftp_lock while using it. """
+        transport = self.get_transport()
+        if self._sftp is None or self._sftp.get_channel().get_transport() is not transport \
+                or self._sftp.get_channel().closed:
+            self._sftp = paramiko.SFTPClient.from_transport(transport)
+        return self._sftp
+
     def CopyFiles(self,source,destination):
         """ This Function copies files to destination nodes
         @param:
         source: name of the file to be copied
         destination: name of file to be saved at the destination node
         """
-        Transport = self.get_transport()
-        sftp = paramiko.SFTPClient.from_transport(Transport)
-        FileAttributes = sftp.put(source, destination)
+        with self._sftp_lock:
+            FileAttributes = self.GetSFTP().put(source, destination)
         return FileAttributes
 
     def GetFiles(self,remotepath,localpath):
@@ -149,13 +402,331 @@ class SSHClient(paramiko.SSHClient):
         remotepath: name of the file to be copied
         localpath: name of file to be saved
         """
-        Transport = self.get_transport()
-        sftp = paramiko.SFTPClient.from_transport(Transport)
-        FileAttributes = sftp.get(remotepath, localpath)
+        with self._sftp_lock:
+            FileAttributes = self.GetSFTP().get(remotepath, localpath)
         return FileAttributes
 
+    def CopyFilesBulk(self, pairs):
+        """ Copies many files to this node over the one cached SFTP session.
+        @param pairs: list of (source, destination) tuples.
+        Returns the number of bytes sent. """
+        start = time.time()
+        sent = 0
+        with self._sftp_lock:
+            sftp = self.GetSFTP()
+            for source, destination in pairs:
+                logger.log.info("Copying %s to %s on %s" % (source, destination, self.hostname))
+                sent += sftp.put(source, destination).st_size
+        log_throughput(self.hostname, "sent", sent, time.time() - start)
+        return sent
+
+    def GetFilesBulk(self, pairs):
+        """ Copies many files from this node over the one cached SFTP session.
+        @param pairs: list of (remotepath, localpath) tuples.
+        Returns the number of bytes received. """
+        start = time.time()
+        received = 0
+        with self._sftp_lock:
+            sftp = self.GetSFTP()
+            for remotepath, localpath in pairs:
+                logger.log.info("Copying %s from %s to %s" % (remotepath, self.hostname, localpath))
+                sftp.get(remotepath, localpath)
+                received += os.path.getsize(localpath)
+        log_throughput(self.hostname, "received", received, time.time() - start)
+        return received
+
+    def CopyTree(self, source, destination, compress=True):
+        """ Copies the local directory source into destination on this node
+        as one tar stream over a single channel. destination is created if
+        missing. Raises IOError if the remote tar fails.
+        Returns the number of bytes sent over the wire. """
+        start = time.time()
+        dest = pipes.quote(destination)
+        channel = self.get_transport().open_session()
+        try:
+            channel.exec_command("mkdir -p %s && tar -x%sf - -C %s" % \
+                                 (dest, 'z' if compress else '', dest))
+            writer = CountingWriter(channel.makefile('wb'))
+            try:
+                tar = tarfile.open(fileobj=writer, mode='w|gz' if compress else 'w|')
+                tar.add(source, arcname='.')
+                tar.close()
+                writer.flush()
+                channel.shutdown_write()
+            except (socket.error, EOFError):
+                # The remote tar went away, its exit status and stderr
+                # below tell why.
+                writer.broken = True
+            errors = [data for name, data in self.ReadChannel(channel) if name == 'stderr']
+            exit_status = channel.recv_exit_status()
+        finally:
+            channel.close()
+        if exit_status != 0:
+            raise IOError("tar of %s to %s:%s failed: %s" % \
+                          (source, self.hostname, destination, ''.join(errors)))
+        log_throughput(self.hostname, "sent", writer.count, time.time() - start)
+        return writer.count
+
+class CountingWriter(object):
+    """ File object wrapper counting the bytes written through it. Once
+    marked broken, further writes are dropped. """
+
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+        self.broken = False
+
+    def write(self, data):
+        if self.broken:
+            return
+        self.f.write(data)
+        self.count += len(data)
+
+    def flush(self):
+        if not self.broken:
+            self.f.flush()
+
+def log_throughput(host, verb, size, seconds):
+    """ Log size bytes moved to or from host in seconds. """
+    rate = size / seconds / 1048576 if seconds > 0 else 0
+    logger.log.info("%s: %s %d bytes in %.2fs (%.2f MB/s)" % \
+                    (host, verb, size, seconds, rate))
+
+class RemoteStream(object):
+    """ Line by line view of a remote command's output.
+
+    Iterating runs the command, feeding it stdin if given, and yields
+    (hostname, stream, line) tuples, stream being 'stdout' or 'stderr', as
+    soon as each line is complete.
+    Nothing but the last `tail` lines of each stream is kept in memory, so
+    memory use does not grow with the size of the output. exit_status is set
+    once iteration has finished.
+    """
+
+    def __init__(self, client, args, tail=STREAM_TAIL_LINES, stdin=None):
+        self.client = client
+        self.args = args
+        self.stdin = stdin
+        self.hostname = client.hostname
+        self.stdout_tail = collections.deque(maxlen=tail)
+        self.stderr_tail = collections.deque(maxlen=tail)
+        self.exit_status = None
+
+    def __iter__(self):
+        tails = {'stdout': self.stdout_tail, 'stderr': self.stderr_tail}
+        partial = {'stdout': '', 'stderr': ''}
+        channel = self.client.get_transport().open_session()
+        try:
+            channel.exec_command(self.args)
+            if self.stdin is not None:
+                channel.sendall(self.stdin)
+                channel.shutdown_write()
+            for name, data in self.client.ReadChannel(channel):
+                lines = (partial[name] + data).split('\n')
+                partial[name] = lines.pop()
+                if len(partial[name]) > STREAM_MAX_LINE:
+                    lines.append(partial[name])
+                    partial[name] = ''
+                for line in lines:
+                    line = line.rstrip('\r')
+                    tails[name].append(line)
+                    yield self.hostname, name, line
+            for name in ('stdout', 'stderr'):
+                if partial[name]:
+                    tails[name].append(partial[name])
+                    yield self.hostname, name, partial[name]
+            self.exit_status = channel.recv_exit_status()
+        finally:
+            channel.close()
+
+class FileStep(object):
+    """ Batch step that writes the contents of the local file source to
+    destination on the remote host and optionally sets its mode. The file
+    is sent inside the batch script, no SFTP session is needed. """
+
+    def __init__(self, source, destination, mode=None):
+        self.source = source
+        self.destination = destination
+        self.mode = mode
+
+    def __str__(self):
+        return "copy %s to %s" % (self.source, self.destination)
+
+    def shell(self, marker):
+        with open(self.source, 'rb') as f:
+            data = base64.encodestring(f.read())
+        dest = pipes.quote(self.destination)
+        lines = ["base64 -d > %s <<'%s_EOF'" % (dest, marker), data + marker + "_EOF"]
+        if self.mode is not None:
+            lines.append("chmod %o %s" % (self.mode, dest))
+        return "\n".join(lines)
+
+class StepResult(object):
+    """ Exit status and last lines of output of one step of a batch. """
+
+    def __init__(self, step, tail=STREAM_TAIL_LINES):
+        self.step = step
+        self.name = str(step)
+        self.exit_status = None
+        self.stdout_tail = collections.deque(maxlen=tail)
+        self.stderr_tail = collections.deque(maxlen=tail)
+
+    def __repr__(self):
+        return "<StepResult %r exit_status=%s>" % (self.name, self.exit_status)
+
+class Batch(object):
+    """
+    Compiles a list of steps into one shell script. Every step runs in its
+    own subshell with stdin from /dev/null, and is framed by marker lines on
+    both stdout and stderr so the output and exit status of each step can be
+    told apart when the script's output is read back.
+    """
+
+    shell = '/bin/bash -s'
+
+    def __init__(self, steps, stop_on_error=False):
+        self.steps = list(steps)
+        self.stop_on_error = stop_on_error
+        self.marker = "__NEXUS_%s" % uuid.uuid4().hex
+        self.statuses = {}
+
+    def results(self, tail=STREAM_TAIL_LINES):
+        return [StepResult(step, tail) for step in self.steps]
+
+    def script(self):
+        lines = []
+        for i, step in enumerate(self.steps):
+            if isinstance(step, FileStep):
+                body = step.shell(self.marker)
+            else:
+                body = step
+            begin = "%s BEGIN %d" % (self.marker, i)
+            lines.append("echo '%s'; echo '%s' >&2" % (begin, begin))
+            lines.append("(\n%s\n) < /dev/null" % body)
+            lines.append("rc=$?")
+            end = "%s END %d $rc" % (self.marker, i)
+            lines.append('echo "%s"; echo "%s" >&2' % (end, end))
+            if self.stop_on_error:
+                lines.append("[ $rc -eq 0 ] || exit $rc")
+        return "\n".join(lines) + "\n"
+
+    def parse_marker(self, line):
+        """ Splits a line of output into (output, step). step is the index
+        of the step a marker belongs to, or None if line holds no marker.
+        output is the text in front of the marker, which is there when a
+        step's output did not end with a newline. END markers record the
+        step's exit status. """
+        pos = line.find(self.marker)
+        if pos < 0:
+            return line, None
+        fields = line[pos:].split()
+        i = int(fields[2])
+        if fields[1] == 'END':
+            self.statuses[i] = int(fields[3])
+        return line[:pos], i
+
+    def collect(self, results):
+        for i, result in enumerate(results):
+            result.exit_status = self.statuses.get(i)
+
+class SSHPool(object):
+    """ Process wide pool of SSHClient connections keyed by (host, port, user).
+    A connection is opened the first time a key is asked for and handed back
+    to every later caller, so all plugins in a run share one SSH session per
+    host. Dead connections are dropped and reopened on the next get().
+    """
+
+    def __init__(self, keepalive=30, retries=DEFAULT_CONNECT_RETRIES,
+                 backoff=DEFAULT_CONNECT_BACKOFF):
+        self.keepalive = keepalive
+        self.retries = retries
+        self.backoff = backoff
+        self._clients = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get(self, hostname, username=None, password=None, port=None,
+            retries=None, backoff=None):
+        """ Return a connected SSHClient for hostname, reusing a pooled
+        connection if it is still healthy. A new connection is retried up to
+        retries times with jittered exponential backoff; authentication
+        failures are not retried. """
+        if port is None:
+            port = 22
+        key = (hostname, port, username)
+        # _clients is only touched under _lock, which close() and close_all()
+        # hold too; the per key lock only keeps two callers from connecting
+        # to the same key at once
+        with self._key_lock(key):
+            with self._lock:
+                client = self._clients.get(key)
+            if client is not None:
+                if client.is_alive():
+                    return client
+                logger.log.info("SSH connection to %s is dead, reconnecting" % hostname)
+                with self._lock:
+                    if self._clients.get(key) is client:
+                        del self._clients[key]
+                client.close()
+            client = self._connect(hostname, port, username, password,
+                                   self.retries if retries is None else retries,
+                                   self.backoff if backoff is None else backoff)
+            client.get_transport().set_keepalive(self.keepalive)
+            with self._lock:
+                self._clients[key] = client
+            return client
+
+    def _connect(self, hostname, port, username, password, retries, backoff):
+        attempt = 0
+        while True:
+            try:
+                return SSHClient(hostname=hostname, port=port, username=username,
+                                 password=password)
+            except paramiko.AuthenticationException:
+                raise
+            except (paramiko.SSHException, socket.error, EOFError) as e:
+                if attempt >= retries:
+                    raise
+                delay = backoff_delay(attempt, backoff)
+                attempt += 1
+                logger.log.warn("Connecting to %s failed (%s), retry %d of %d in %.1fs" % \
+                                (hostname, e, attempt, retries, delay))
+                time.sleep(delay)
+
+    def close(self, hostname):
+        """ Close and forget every pooled connection to hostname. """
+        with self._lock:
+            keys = [k for k in self._clients if k[0] == hostname]
+            clients = [self._clients.pop(k) for k in keys]
+        for client in clients:
+            client.close()
+
+    def close_all(self):
+        """ Close every pooled connection. Registered with atexit. """
+        with self._lock:
+            clients = self._clients.values()
+            self._clients = {}
+        for client in clients:
+            client.close()
+
+def backoff_delay(attempt, base, cap=DEFAULT_CONNECT_BACKOFF_MAX):
+    """ Delay before retry number attempt (counting from 0): exponential in
+    attempt, capped at cap, with random jitter so that many hosts failing at
+    once do not retry in lockstep. """
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+ssh_pool = SSHPool()
+atexit.register(ssh_pool.close_all)
+
 class Platform:
-    """ This class will check the OS distribution and architecture
+    """ This class will check the OS distribution and architecture.
+    Values come from nexus.lib.facts, so each host is asked only once
+    per run.
     """
     def __init__(self, host, username, password):
         self.host = host
@@ -163,22 +734,9 @@ class Platform:
         self.password = password
 
     def GetDist(self):
-        ssh_c = SSHClient(hostname = self.host, username = \
-                                  self.username, password = self.password)
-
-        stdin, stdout, stderr = ssh_c.ExecuteCmd('python -c "import platform; \
-                                                 print platform.dist()"')
-        dist = stdout.read()
-        dist = str(dist).replace('(','').replace(')','').replace("'", "").\
-               replace(',','')
-        dist = dist.split()
-        return dist
+        from nexus.lib import facts
+        return list(facts.get(self.host, self.username, self.password).dist)
 
     def GetArch(self):
-        ssh_c = SSHClient(hostname = self.host, username = \
-                                  self.username, password = self.password)
-
-        stdin, stdout, stderr = ssh_c.ExecuteCmd('python -c "import platform; \
-                                                 print platform.machine()"')
-        arch = stdout.read()
-        return arch
+        from nexus.lib import facts
+        return facts.get(self.host, self.username, self.password).arch
@@ -0,0 +1,148 @@
+#!/usr/bin/python
+# Copyright (c) 2015 Red Hat, Inc. All rights reserved.
+#
+# This copyrighted material is made available to anyone wishing
+# to use, modify, copy, or redistribute it subject to the terms
+# and conditions of the GNU General Public License version 2.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program; if not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+
+"""
+Facts about test resources: distribution, arch, python and restraint
+versions and free disk space. Facts are collected with a single remote
+command per host, kept for the rest of the run and, if the conf has a
+[facts] cache_dir, on disk for cache_ttl seconds.
+"""
+
+import os
+import json
+import time
+import errno
+import threading
+from nexus.lib import logger
+from nexus.lib.factory import ssh_pool
+from nexus.lib.factory import max_workers
+from nexus.lib.hostgroup import HostGroup
+
+FACTS_SCRIPT = """
+python -c 'import platform, sys; print("dist=%s" % " ".join(platform.dist())); print("python=%s" % sys.version.split()[0])' 2>/dev/null
+[ -r /etc/os-release ] && (. /etc/os-release; echo "os_release=$ID $VERSION_ID")
+echo "arch=$(uname -m)"
+echo "restraint=$(rpm -q --qf '%{VERSION}-%{RELEASE}' restraint 2>/dev/null)"
+echo "disk_free=$(df -Pk / | awk 'NR==2 {print $4}')"
+"""
+
+DEFAULT_CACHE_TTL = 3600
+
+_facts = {}
+_lock = threading.Lock()
+
+class HostFacts(object):
+    """ Facts of one host. dist is in the format Platform.GetDist() always
+    returned: [distname, version, id]. disk_free is in KB. """
+
+    def __init__(self, host, values):
+        self.host = host
+        self.values = values
+        # platform.dist() is gone from newer pythons, fall back to os-release
+        self.dist = (values.get('dist') or values.get('os_release', '')).split()
+        self.version = self.dist[1] if len(self.dist) > 1 else None
+        self.arch = values.get('arch', '')
+        self.python = values.get('python', '')
+        self.restraint = values.get('restraint') or None
+        disk_free = values.get('disk_free', '')
+        self.disk_free = int(disk_free) if disk_free.isdigit() else None
+
+    def __repr__(self):
+        return "<HostFacts %s %s>" % (self.host, self.values)
+
+def _cache_settings(conf_dict):
+    section = (conf_dict or {}).get('facts', {})
+    ttl = section.get('cache_ttl') or DEFAULT_CACHE_TTL
+    return section.get('cache_dir'), float(ttl)
+
+def _read_cache(cache_dir, host, ttl):
+    path = os.path.join(cache_dir, host + ".json")
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if time.time() - cached.get('time', 0) > ttl:
+        return None
+    return cached['values']
+
+def _write_cache(cache_dir, host, values):
+    # every host of a gather() writes at once, several may create cache_dir
+    try:
+        os.makedirs(cache_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    path = os.path.join(cache_dir, host + ".json")
+    tmp = path + ".tmp.%d" % os.getpid()
+    with open(tmp, 'w') as f:
+        json.dump({'time': time.time(), 'values': values}, f)
+    os.rename(tmp, path)
+
+def collect(host, username, password):
+    """ Run the facts script on host and return its key=value output. """
+    ssh_c = ssh_pool.get(host, username, password)
+    stream = ssh_c.StreamScript('/bin/bash -s', stdin=FACTS_SCRIPT)
+    values = {}
+    for h, name, line in stream:
+        if name == 'stdout' and '=' in line:
+            key, value = line.split('=', 1)
+            values[key] = value.strip()
+    return values
+
+def get(host, username, password, conf_dict=None):
+    """ Facts of host, collected at most once per run. """
+    with _lock:
+        if host in _facts:
+            return _facts[host]
+
+    cache_dir, ttl = _cache_settings(conf_dict)
+    values = None
+    if cache_dir:
+        values = _read_cache(cache_dir, host, ttl)
+    if values is None:
+        logger.log.info("Collecting facts of %s" % host)
+        values = collect(host, username, password)
+        if cache_dir:
+            _write_cache(cache_dir, host, values)
+
+    facts = HostFacts(host, values)
+    logger.log.info("Facts of %s: %s" % (host, values))
+    with _lock:
+        return _facts.setdefault(host, facts)
+
+def gather(hosts, username, password, conf_dict=None):
+    """
+    Facts of all hosts, collected in parallel. Returns a dict keyed by
+    host of those that could be reached. Like any HostGroup operation it
+    only fails if fewer hosts than the host_quorum of the conf answered.
+    """
+    conf_dict = conf_dict or {}
+    if 'jenkins' in conf_dict:
+        group = HostGroup.from_conf(hosts, username, password, conf_dict)
+    else:
+        group = HostGroup(hosts, username, password,
+                          max_workers=max_workers(conf_dict, 'hosts'))
+
+    def gather_facts(host):
+        return get(host, username, password, conf_dict)
+
+    results = group.map(gather_facts)
+    return dict((r.host, r.value) for r in results if r.ok)
+
+def forget(host=None):
+    """ Drop the facts of host, or of all hosts, from the run's memo. """
+    with _lock:
+        if host is None:
+            _facts.clear()
+        else:
+            _facts.pop(host, None)
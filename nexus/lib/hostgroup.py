@@ -0,0 +1,281 @@
+#!/usr/bin/python
+# Copyright (c) 2015 Red Hat, Inc. All rights reserved.
+#
+# This copyrighted material is made available to anyone wishing
+# to use, modify, copy, or redistribute it subject to the terms
+# and conditions of the GNU General Public License version 2.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program; if not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+
+""" Run the same operation on every test resource concurrently """
+
+import os
+import time
+from nexus.lib import logger
+from nexus.lib.factory import ssh_pool
+from nexus.lib.factory import max_workers
+from nexus.lib.factory import TaskTimeout
+from nexus.lib.factory import WorkerPool
+from nexus.lib.factory import DEFAULT_MAX_WORKERS
+from nexus.lib.engine import EventEngine
+from nexus.lib.engine import ExecJob
+from nexus.lib.engine import PutTreeJob
+
+class HostGroupError(Exception):
+    """ Raised when fewer hosts than the quorum completed an operation. """
+
+    def __init__(self, message, results):
+        Exception.__init__(self, message)
+        self.results = results
+
+class HostResult(object):
+    """ Outcome of one HostGroup operation on one host.
+
+    exit_status, stdout_tail and stderr_tail are set for remote commands,
+    value holds the return value of functions run through map(), error the
+    exception raised on that host if any, and wall_time the seconds spent.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.exit_status = None
+        self.stdout_tail = []
+        self.stderr_tail = []
+        self.value = None
+        self.error = None
+        self.wall_time = 0.0
+
+    @property
+    def ok(self):
+        return self.error is None and self.exit_status in (None, 0)
+
+    def __repr__(self):
+        return "<HostResult %s ok=%s exit_status=%s wall_time=%.2fs>" % \
+               (self.host, self.ok, self.exit_status, self.wall_time)
+
+class HostGroup(object):
+    """ A set of hosts sharing one set of credentials.
+
+    Every operation runs on all hosts at once and returns a list of
+    HostResult in host order. An operation succeeds when at least quorum
+    hosts succeeded, otherwise HostGroupError is raised. quorum may be a
+    number of hosts, a percentage such as "95%" or None for all hosts.
+    At most max_workers hosts are worked on at a time, and a host that takes
+    longer than timeout seconds is counted as failed.
+
+    With engine='event', run(), script() and put_tree() open the connections
+    on max_workers threads and then drive the remote side of all hosts from
+    a single thread with nexus.lib.engine instead of a thread per host.
+    """
+
+    def __init__(self, hosts, username, password, port=None, quorum=None,
+                 max_workers=DEFAULT_MAX_WORKERS, timeout=None, engine='threads'):
+        self.hosts = list(hosts)
+        self.username = username
+        self.password = password
+        self.port = port
+        self.quorum = quorum
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.engine = engine
+
+    @classmethod
+    def from_conf(cls, hosts, username, password, conf_dict):
+        """
+        HostGroup configured from the conf: host_quorum from the jenkins
+        section, hosts, host_timeout and engine from the concurrency section.
+        """
+        concurrency = conf_dict.get('concurrency', {})
+        timeout = concurrency.get('host_timeout')
+        return cls(hosts, username, password,
+                   quorum=conf_dict['jenkins'].get('host_quorum'),
+                   max_workers=max_workers(conf_dict, 'hosts'),
+                   timeout=float(timeout) if timeout else None,
+                   engine=concurrency.get('engine', 'threads'))
+
+    def required(self):
+        """ Number of hosts that have to succeed for an operation to pass. """
+        quorum = self.quorum
+        if quorum is None or quorum == '':
+            return len(self.hosts)
+        quorum = str(quorum).strip()
+        if quorum.endswith('%'):
+            needed = int(-(-len(self.hosts) * float(quorum[:-1]) // 100))
+        else:
+            needed = int(quorum)
+        return max(1, min(needed, len(self.hosts)))
+
+    def client(self, host):
+        """ Pooled SSHClient for host. """
+        return ssh_pool.get(host, self.username, self.password, self.port)
+
+    def _fanout(self, name, f):
+        """ Call f(host, result) for every host on a WorkerPool, time it
+        and record any exception on the result. Checks the quorum. """
+        results = [HostResult(host) for host in self.hosts]
+
+        def runit(result):
+            start = time.time()
+            try:
+                f(result.host, result)
+            except Exception as e:
+                logger.log.error("%s failed on %s: %s" % (name, result.host, e))
+                result.error = e
+            result.wall_time = time.time() - start
+
+        pool = WorkerPool(self.max_workers)
+        futures = [pool.submit(runit, result) for result in results]
+        for future, result in zip(futures, results):
+            try:
+                future.result(self.timeout)
+            except TaskTimeout as e:
+                logger.log.error("%s timed out on %s" % (name, result.host))
+                result.error = e
+                result.wall_time = self.timeout
+        pool.shutdown()
+
+        return self.check(name, results)
+
+    def _event_fanout(self, name, make_job):
+        """ Connect to every host on a WorkerPool, then run make_job(client)
+        for all of them on one EventEngine. """
+        results = [HostResult(host) for host in self.hosts]
+
+        pool = WorkerPool(self.max_workers)
+        futures = [pool.submit(self.client, host) for host in self.hosts]
+        jobs = []
+        for future, result in zip(futures, results):
+            try:
+                jobs.append((make_job(future.result()), result))
+            except Exception as e:
+                logger.log.error("%s failed on %s: %s" % (name, result.host, e))
+                result.error = e
+        pool.shutdown()
+
+        EventEngine(self.timeout).run([job for job, result in jobs])
+        for job, result in jobs:
+            result.error = job.error
+            result.wall_time = job.wall_time
+            result.exit_status = job.exit_status
+            result.stdout_tail = list(job.stdout_tail)
+            result.stderr_tail = list(job.stderr_tail)
+            result.value = getattr(job, 'sent', None)
+
+        return self.check(name, results)
+
+    def check(self, name, results):
+        """ Log a summary of results and raise HostGroupError if the
+        quorum was not reached. """
+        failed = [r for r in results if not r.ok]
+        needed = self.required()
+        succeeded = len(results) - len(failed)
+        for r in failed:
+            logger.log.warn("%s: %s failed (exit status %s, error %s)" % \
+                            (r.host, name, r.exit_status, r.error))
+        logger.log.info("%s succeeded on %d of %d hosts (quorum %d)" % \
+                        (name, succeeded, len(results), needed))
+        if succeeded < needed:
+            raise HostGroupError("%s succeeded on %d of %d hosts, %d needed" % \
+                                 (name, succeeded, len(results), needed), results)
+        return results
+
+    def preflight(self, retries=None, backoff=None, drop_unreachable=False):
+        """
+        Connect to every host before any real work, retrying with jittered
+        backoff, and log the connect latency of each. HostResult.value holds
+        the latency in seconds. With drop_unreachable, hosts that could not
+        be reached are removed from the group instead of counting against
+        the quorum.
+        """
+        def f(host, result):
+            start = time.time()
+            ssh_pool.get(host, self.username, self.password, self.port,
+                         retries=retries, backoff=backoff)
+            result.value = time.time() - start
+            logger.log.info("%s: connected in %.2fs" % (host, result.value))
+
+        if not drop_unreachable:
+            return self._fanout("preflight", f)
+
+        quorum, self.quorum = self.quorum, 0
+        try:
+            results = self._fanout("preflight", f)
+        finally:
+            self.quorum = quorum
+        unreachable = [r.host for r in results if not r.ok]
+        if unreachable:
+            logger.log.warn("Dropping unreachable hosts: %s" % ", ".join(unreachable))
+            self.hosts = [h for h in self.hosts if h not in unreachable]
+        if not self.hosts:
+            raise HostGroupError("preflight: no host is reachable", results)
+        return results
+
+    def _remote(self, args, stdin, tail):
+        def f(host, result):
+            stream = self.client(host).ExecuteLogged(args, tail, stdin)
+            result.exit_status = stream.exit_status
+            result.stdout_tail = list(stream.stdout_tail)
+            result.stderr_tail = list(stream.stderr_tail)
+        return f
+
+    def run(self, args, tail=100):
+        """ Run the command args on every host, logging output live. """
+        if self.engine == 'event':
+            return self._event_fanout(args, lambda c: ExecJob(c, args, None, tail))
+        return self._fanout(args, self._remote(args, None, tail))
+
+    def script(self, script, interpreter='/bin/bash -s', tail=100):
+        """ Run the text of script on every host by feeding it to the
+        standard input of interpreter. """
+        if self.engine == 'event':
+            return self._event_fanout(interpreter,
+                                      lambda c: ExecJob(c, interpreter, script, tail))
+        return self._fanout(interpreter, self._remote(interpreter, script, tail))
+
+    def batch(self, steps, stop_on_error=False, tail=100):
+        """ Run a list of steps on every host with SSHClient.ExecuteBatch,
+        one round trip per host. HostResult.value holds the StepResult
+        list, exit_status is that of the first failed step or 0. """
+        def f(host, result):
+            steps_results = self.client(host).ExecuteBatch(steps, stop_on_error, tail)
+            result.value = steps_results
+            failed = [r.exit_status for r in steps_results if r.exit_status]
+            result.exit_status = failed[0] if failed else 0
+        return self._fanout("batch of %d steps" % len(steps), f)
+
+    def put(self, source, destination):
+        """ Copy the local file source to destination on every host. """
+        def f(host, result):
+            logger.log.info("Copying %s to %s on %s" % (source, destination, host))
+            result.value = self.client(host).CopyFiles(source, destination)
+        return self._fanout("copy %s" % source, f)
+
+    def put_tree(self, source, destination, compress=True):
+        """ Copy the local directory source into destination on every host,
+        as one tar stream per host. HostResult.value is the bytes sent. """
+        if self.engine == 'event':
+            return self._event_fanout("copy %s" % source,
+                                      lambda c: PutTreeJob(c, source, destination, compress))
+        def f(host, result):
+            logger.log.info("Copying %s to %s on %s" % (source, destination, host))
+            result.value = self.client(host).CopyTree(source, destination, compress)
+        return self._fanout("copy %s" % source, f)
+
+    def get(self, remotepath, localpath):
+        """ Copy remotepath from every host. localpath may contain {host},
+        which is replaced by the name of the host the file came from. """
+        def f(host, result):
+            dest = localpath.format(host=host)
+            logger.log.info("Copying %s from %s to %s" % (remotepath, host, dest))
+            result.value = self.client(host).GetFiles(remotepath, dest)
+        return self._fanout("get %s" % os.path.basename(remotepath), f)
+
+    def map(self, f, *args):
+        """ Call f(host, *args) for every host. The return value is stored
+        in HostResult.value. """
+        def call(host, result):
+            result.value = f(host, *args)
+        return self._fanout(f.__name__, call)
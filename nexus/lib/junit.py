@@ -0,0 +1,128 @@
+#!/usr/bin/python
+# Copyright (c) 2015 Red Hat, Inc. All rights reserved.
+#
+# This copyrighted material is made available to anyone wishing
+# to use, modify, copy, or redistribute it subject to the terms
+# and conditions of the GNU General Public License version 2.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program; if not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+
+"""
+Convert the job.xml restraint leaves behind to JUnit xml.
+
+Every recipe becomes a testsuite named after the system it ran on, and
+every task in it a testcase. The job is read with iterparse and every task
+is written out and dropped as soon as it has been read, the testcases of a
+recipe waiting in a temporary file until the counts of its testsuite are
+known, so memory use does not grow with the size of the job.
+"""
+
+import re
+import shutil
+import tempfile
+import xml.etree.cElementTree as ET
+from xml.sax.saxutils import escape
+from xml.sax.saxutils import quoteattr
+from nexus.lib import logger
+
+FAILURES = ('FAIL',)
+ERRORS = ('WARN', 'PANIC')
+SKIPPED = ('SKIP',)
+
+DURATION = re.compile(r'(?:(\d+) days?,? *)?(\d+):(\d+):(\d+)')
+
+def _utf8(text):
+    return text.encode('utf-8') if isinstance(text, unicode) else text
+
+def duration_seconds(duration):
+    """ Seconds in a restraint duration such as 01:02:03 or 1 day 01:02:03,
+    0 if there is none. """
+    match = DURATION.search(duration or '')
+    if not match:
+        return 0
+    days, hours, minutes, seconds = [int(g or 0) for g in match.groups()]
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+class Suite(object):
+    """ Counts of the recipe being converted and its testcases so far. """
+
+    def __init__(self, recipe):
+        self.name = recipe.get('system') or "recipe %s" % recipe.get('id', '')
+        self.id = recipe.get('id', '')
+        self.tests = 0
+        self.failures = 0
+        self.errors = 0
+        self.skipped = 0
+        self.time = 0
+        self.cases = tempfile.TemporaryFile()
+
+    def add(self, task):
+        result = (task.get('result') or '').upper()
+        seconds = duration_seconds(task.get('duration'))
+        self.tests += 1
+        self.time += seconds
+
+        case = "    <testcase classname=%s name=%s time=\"%d\"" % \
+               (quoteattr(self.name), quoteattr(task.get('name', '')), seconds)
+        results = task.find('results')
+        details = []
+        if results is not None:
+            for r in results.findall('result'):
+                details.append("%s: %s (score %s)" % (r.get('path', ''),
+                               r.get('result', ''), r.get('score', '')))
+        message = quoteattr("%s %s" % (result, task.get('status', '')))
+        if result in FAILURES:
+            self.failures += 1
+            case += ">\n      <failure type=\"%s\" message=%s>%s</failure>\n" \
+                    "    </testcase>\n" % (result, message, escape("\n".join(details)))
+        elif result in ERRORS:
+            self.errors += 1
+            case += ">\n      <error type=\"%s\" message=%s>%s</error>\n" \
+                    "    </testcase>\n" % (result, message, escape("\n".join(details)))
+        elif result in SKIPPED:
+            self.skipped += 1
+            case += ">\n      <skipped/>\n    </testcase>\n"
+        else:
+            case += "/>\n"
+        self.cases.write(_utf8(case))
+
+    def write(self, out):
+        out.write(_utf8("  <testsuite name=%s id=%s tests=\"%d\" failures=\"%d\" "
+                        "errors=\"%d\" skipped=\"%d\" time=\"%d\">\n" % \
+                        (quoteattr(self.name), quoteattr(self.id), self.tests,
+                         self.failures, self.errors, self.skipped, self.time)))
+        self.cases.seek(0)
+        shutil.copyfileobj(self.cases, out)
+        self.cases.close()
+        out.write("  </testsuite>\n")
+
+def job_to_junit(job_xml, junit_xml):
+    """
+    Write the JUnit version of the restraint job.xml at job_xml to
+    junit_xml. Returns the number of testcases written.
+    """
+    tests = 0
+    suite = None
+    with open(junit_xml, 'w') as out:
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n<testsuites>\n')
+        for event, element in ET.iterparse(job_xml, events=('start', 'end')):
+            if event == 'start':
+                if element.tag == 'recipe':
+                    suite = Suite(element)
+                continue
+            if element.tag == 'task' and suite is not None:
+                suite.add(element)
+                element.clear()
+            elif element.tag == 'recipe' and suite is not None:
+                suite.write(out)
+                tests += suite.tests
+                suite = None
+                element.clear()
+            elif element.tag == 'recipeSet':
+                element.clear()
+        out.write('</testsuites>\n')
+    logger.log.info("Wrote %d testcases from %s to %s" % (tests, job_xml, junit_xml))
+    return tests
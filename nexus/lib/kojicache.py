@@ -0,0 +1,186 @@
+#!/usr/bin/python
+# Copyright (c) 2015 Red Hat, Inc. All rights reserved.
+#
+# This copyrighted material is made available to anyone wishing
+# to use, modify, copy, or redistribute it subject to the terms
+# and conditions of the GNU General Public License version 2.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program; if not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+
+"""
+Koji hub queries, batched into multicalls and cached on disk.
+
+listTagged results are kept per tag and package together with the hub event
+they were read at. The next run asks the hub for its last event; if it has
+not moved, or tagChangedSinceEvent says neither the tag nor any tag it
+inherits from changed since, the cached builds are used. A run where
+nothing changed thus costs one or two cheap calls. The rpms of a build never
+change, so listRPMs results are kept per build and arches for good.
+"""
+
+import os
+import json
+import errno
+import hashlib
+from nexus.lib import logger
+
+def multicall(session, calls):
+    """
+    Sends calls, a list of (method, args, kwargs), to the hub of session as
+    one multicall and returns their results in order. A fault in any of the
+    calls is raised as IOError.
+    """
+    if not calls:
+        return []
+    session.multicall = True
+    for method, args, kwargs in calls:
+        getattr(session, method)(*args, **kwargs)
+    results = []
+    for (method, args, kwargs), result in zip(calls, session.multiCall()):
+        if isinstance(result, dict):
+            raise IOError("%s%s failed: %s" % (method, args,
+                                               result.get('faultString')))
+        results.append(result[0])
+    return results
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+def _write_json(path, data):
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    tmp = path + ".tmp.%d" % os.getpid()
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.rename(tmp, path)
+
+class KojiCache(object):
+    """
+    Cached view of the hub of session, stored in cache_dir. Without a
+    cache_dir every query goes to the hub, still batched into multicalls.
+    """
+
+    def __init__(self, session, cache_dir=None):
+        self.session = session
+        self.cache_dir = cache_dir
+        if cache_dir:
+            hub = getattr(session, 'baseurl', '') or ''
+            self.hub_dir = os.path.join(cache_dir, hashlib.sha1(hub).hexdigest()[:12])
+
+    @classmethod
+    def from_conf(cls, session, conf_dict):
+        """ KojiCache in the metadata_dir of the [cache] section of the
+        conf, if any. """
+        return cls(session, (conf_dict or {}).get('cache', {}).get('metadata_dir'))
+
+    def tag_path(self, tag):
+        return os.path.join(self.hub_dir, 'tags', "%s.json" % tag)
+
+    def rpms_path(self, build_id, arches):
+        if isinstance(arches, basestring):
+            arches = [arches]
+        return os.path.join(self.hub_dir, 'rpms',
+                            "%s-%s.json" % (build_id, '-'.join(arches or ['all'])))
+
+    def tag_state(self, tag):
+        """
+        Cached state of tag at the hub's last event: a dict with the
+        'event' it is valid at, the ids of the tag and its parents under
+        'tags' and the cached listTagged results under 'packages'. If
+        nothing is cached or the tag changed, the state is empty and
+        'tags' is None.
+        """
+        event = self.session.getLastEvent()['id']
+        state = _read_json(self.tag_path(tag))
+        if state is None:
+            return {'event': event, 'tags': None, 'packages': {}}
+        if state['event'] != event:
+            if self.session.tagChangedSinceEvent(state['event'], state['tags']):
+                logger.log.info("%s changed since event %s, refreshing" % \
+                                (tag, state['event']))
+                return {'event': event, 'tags': None, 'packages': {}}
+            state['event'] = event
+        return state
+
+    def list_tagged(self, tag, packages):
+        """
+        Latest builds of each of packages in tag, inherited ones included,
+        as one list per package. A package of None stands for all
+        packages in the tag.
+        """
+        kwargs = [{'latest': True, 'type': None, 'inherit': True} for p in packages]
+        for package, kw in zip(packages, kwargs):
+            if package is not None:
+                kw['package'] = package
+        if not self.cache_dir:
+            return multicall(self.session, [('listTagged', (tag,), kw) for kw in kwargs])
+
+        state = self.tag_state(tag)
+        cached = state['packages']
+        missing = [(p, kw) for p, kw in zip(packages, kwargs) if (p or '') not in cached]
+        calls = [('listTagged', (tag,), kw) for p, kw in missing]
+        if state['tags'] is None:
+            calls += [('getTag', (tag,), {}), ('getFullInheritance', (tag,), {})]
+        results = multicall(self.session, calls)
+        if state['tags'] is None:
+            parents = results.pop()
+            state['tags'] = [results.pop()['id']] + \
+                            [parent['parent_id'] for parent in parents]
+        for (package, kw), builds in zip(missing, results):
+            cached[package or ''] = builds
+        logger.log.info("%d of %d listTagged results for %s taken from the cache" % \
+                        (len(packages) - len(missing), len(packages), tag))
+        _write_json(self.tag_path(tag), state)
+        return [cached[package or ''] for package in packages]
+
+    def list_rpms(self, build_ids, arches):
+        """ rpms of each of build_ids for arches, one list per build. """
+        if not self.cache_dir:
+            return multicall(self.session, [('listRPMs', (build_id,), {'arches': arches})
+                                            for build_id in build_ids])
+
+        rpms = dict((build_id, _read_json(self.rpms_path(build_id, arches)))
+                    for build_id in build_ids)
+        missing = [build_id for build_id in build_ids if rpms[build_id] is None]
+        results = multicall(self.session, [('listRPMs', (build_id,), {'arches': arches})
+                                           for build_id in missing])
+        for build_id, result in zip(missing, results):
+            rpms[build_id] = result
+            _write_json(self.rpms_path(build_id, arches), result)
+        return [rpms[build_id] for build_id in build_ids]
+
+def latest_rpms(cache, pathinfo, tag, packages, arches):
+    """
+    rpms of the latest builds of packages in tag, as returned by listRPMs
+    for arches, with the download URL built from pathinfo added as 'url'
+    and the NVR of their build as 'build_nvr'. A package of None stands for
+    all packages in the tag.
+    """
+    builds = []
+    seen = set()
+    for tagged in cache.list_tagged(tag, packages):
+        for build in tagged:
+            if build['id'] not in seen:
+                seen.add(build['id'])
+                builds.append(build)
+    logger.log.info("%d builds tagged with %s" % (len(builds), tag))
+
+    rpms_list = []
+    rpms_all = cache.list_rpms([build['id'] for build in builds], arches)
+    for build, rpms in zip(builds, rpms_all):
+        buildpath = pathinfo.build(build)
+        for rpm in rpms:
+            rpm['url'] = os.path.join(buildpath, pathinfo.rpm(rpm))
+            rpm['build_nvr'] = build['nvr']
+            rpms_list.append(rpm)
+    return rpms_list
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# Copyright (c) 2015 Red Hat, Inc. All rights reserved.
+#
+# This copyrighted material is made available to anyone wishing
+# to use, modify, copy, or redistribute it subject to the terms
+# and conditions of the GNU General Public License version 2.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program; if not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+
+"""
+Serve a directory of downloaded rpms to test resources as a yum repository.
+
+The slave downloads every package once; the test resources then install
+from it over HTTP instead of each pulling the same packages from upstream.
+"""
+
+import os
+import socket
+import threading
+import subprocess
+import BaseHTTPServer
+import SocketServer
+import SimpleHTTPServer
+from nexus.lib import logger
+
+CREATEREPO_COMMANDS = ('createrepo_c', 'createrepo')
+
+def find_command(names):
+    """ Path of the first of names found in PATH, None if there is none. """
+    for name in names:
+        for directory in os.environ.get('PATH', '').split(os.pathsep):
+            path = os.path.join(directory, name)
+            if os.access(path, os.X_OK):
+                return path
+    return None
+
+def createrepo(directory):
+    """ Generate or update the repodata of the rpms in directory. """
+    command = find_command(CREATEREPO_COMMANDS)
+    if command is None:
+        raise OSError("Neither %s is installed" % " nor ".join(CREATEREPO_COMMANDS))
+    logger.log.info("Generating repodata for %s" % directory)
+    subprocess.check_call([command, '--update', directory])
+
+def repo_file(name, baseurl):
+    """ Text of a .repo file for the repository name at baseurl. """
+    return "[%s]\nname=%s\nbaseurl=%s\nenabled=1\ngpgcheck=0\n" \
+           "skip_if_unavailable=1\nmetadata_expire=0\n" % (name, name, baseurl)
+
+class _Handler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    """ Serves the directory of the server rather than the cwd. """
+
+    def translate_path(self, path):
+        path = SimpleHTTPServer.SimpleHTTPRequestHandler.translate_path(self, path)
+        return os.path.join(self.server.directory, os.path.relpath(path, os.getcwd()))
+
+    def log_message(self, format, *args):
+        logger.log.debug("%s: %s" % (self.client_address[0], format % args))
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class RepoServer(object):
+    """
+    HTTP server for directory running in a background thread. host is the
+    name test resources reach the slave at, the fully qualified name of the
+    slave by default. With port 0 a free port is picked.
+    """
+
+    def __init__(self, directory, host=None, port=0):
+        self.directory = os.path.abspath(directory)
+        self.host = host or socket.getfqdn()
+        self.httpd = _Server(('', int(port)), _Handler)
+        self.httpd.directory = self.directory
+        self.port = self.httpd.server_address[1]
+        self.thread = None
+
+    @classmethod
+    def from_conf(cls, directory, conf_dict):
+        """ RepoServer for directory with the host and port of the
+        [repo_server] section of the conf. """
+        section = conf_dict.get('repo_server', {})
+        return cls(directory, section.get('host'), section.get('port') or 0)
+
+    @property
+    def url(self):
+        return "http://%s:%d/" % (self.host, self.port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        logger.log.info("Serving %s at %s" % (self.directory, self.url))
+        return self
+
+    def stop(self):
+        if self.thread is not None:
+            self.httpd.shutdown()
+            self.thread.join()
+            self.thread = None
+        self.httpd.server_close()
+        logger.log.info("Stopped serving %s" % self.directory)
@@ -0,0 +1,216 @@
+#!/usr/bin/python
+# Copyright (c) 2015 Red Hat, Inc. All rights reserved.
+#
+# This copyrighted material is made available to anyone wishing
+# to use, modify, copy, or redistribute it subject to the terms
+# and conditions of the GNU General Public License version 2.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program; if not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+
+"""
+Local cache of downloaded rpms shared by runs on the same slave.
+
+rpms are keyed by their NVRA and the payload hash the hub reports, so a
+rebuilt rpm never matches a stale entry and an rpm fetched for brew and for
+errata is stored once; files the hub does not know are keyed by the URL. Entries are handed out by hardlink when
+the download location is on the same filesystem, and otherwise by the
+cheapest copy the filesystems allow: a reflink sharing the blocks, an in
+kernel copy_file_range, or a plain copy. The cache is kept under
+cache_max_size by evicting the least recently used entries, recency being
+the mtime refreshed on every hit.
+"""
+
+import os
+import fcntl
+import ctypes
+import shutil
+import errno
+import hashlib
+import threading
+from nexus.lib import logger
+
+DEFAULT_MAX_SIZE = 10 * 1024 ** 3
+
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+def parse_size(value):
+    """ Bytes in value, a number optionally followed by K, M, G or T. """
+    value = str(value).strip().upper().rstrip('B')
+    if value and value[-1] in SIZE_UNITS:
+        return int(float(value[:-1]) * SIZE_UNITS[value[-1]])
+    return int(value)
+
+def rpm_key(rpm):
+    """ Cache key of a hub rpm dict: its NVRA and payload hash. """
+    nvra = "%(name)s-%(version)s-%(release)s.%(arch)s" % rpm
+    return hashlib.sha1("%s:%s" % (nvra, rpm.get('payloadhash', ''))).hexdigest()
+
+def url_key(url):
+    """ Cache key of a file known only by its URL. """
+    return hashlib.sha1(url).hexdigest()
+
+# ioctl sharing the blocks of one file with another, _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+# errors meaning a reflink or copy_file_range is not possible between two
+# files, so the next way of copying should be tried
+CLONE_ERRORS = (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL,
+                errno.ENOSYS, errno.EBADF, errno.EPERM)
+
+def _load_copy_file_range():
+    try:
+        f = ctypes.CDLL(None, use_errno=True).copy_file_range
+    except (OSError, AttributeError):
+        return None
+    f.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p,
+                  ctypes.c_size_t, ctypes.c_uint]
+    f.restype = ctypes.c_ssize_t
+    return f
+
+_copy_file_range = _load_copy_file_range()
+
+def _copy_range(src, dst):
+    """ Copy the file src to dst in the kernel. Returns False if
+    copy_file_range is not available for them. """
+    if _copy_file_range is None:
+        return False
+    left = os.fstat(src.fileno()).st_size
+    while left > 0:
+        copied = _copy_file_range(src.fileno(), None, dst.fileno(), None, left, 0)
+        if copied < 0:
+            error = ctypes.get_errno()
+            if error in CLONE_ERRORS:
+                return False
+            raise OSError(error, os.strerror(error))
+        if copied == 0:
+            return False
+        left -= copied
+    return True
+
+def clone_file(source, dest):
+    """
+    Copy source to dest by reflink if the filesystem supports it, else with
+    copy_file_range, else by reading and writing it. Returns the way used:
+    'reflink', 'copy_file_range' or 'copy'.
+    """
+    with open(source, 'rb') as src:
+        with open(dest, 'wb') as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return 'reflink'
+            except IOError as e:
+                if e.errno not in CLONE_ERRORS:
+                    raise
+            if _copy_range(src, dst):
+                return 'copy_file_range'
+            src.seek(0)
+            dst.seek(0)
+            dst.truncate()
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+            return 'copy'
+
+def _tmp_name(path):
+    return "%s.tmp.%d.%d" % (path, os.getpid(), threading.current_thread().ident)
+
+def link_or_copy(source, dest):
+    """ Make dest a hardlink of source, or a clone_file() copy if they are
+    on different filesystems. dest is replaced atomically if it exists.
+    Returns the way used, 'link' or one of those of clone_file(). """
+    if os.path.exists(dest) and os.path.samefile(source, dest):
+        return 'link'
+    tmp = _tmp_name(dest)
+    try:
+        os.link(source, tmp)
+        how = 'link'
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        try:
+            how = clone_file(source, tmp)
+        except (IOError, OSError):
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+    os.rename(tmp, dest)
+    return how
+
+class RPMCache(object):
+    """ Cache in cache_dir holding at most max_size bytes. An entry lives in
+    cache_dir/<key[:2]>/<key>/<file name>. """
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    @classmethod
+    def from_conf(cls, conf_dict):
+        """ RPMCache of the [cache] section of the conf, None if it has no
+        cache_dir. """
+        section = (conf_dict or {}).get('cache', {})
+        if not section.get('cache_dir'):
+            return None
+        max_size = section.get('cache_max_size')
+        return cls(section['cache_dir'],
+                   parse_size(max_size) if max_size else DEFAULT_MAX_SIZE)
+
+    def path(self, key, name):
+        return os.path.join(self.cache_dir, key[:2], key, name)
+
+    def materialize(self, key, dest):
+        """ Put the cached copy of key at dest. Returns False on a miss. """
+        path = self.path(key, os.path.basename(dest))
+        try:
+            link_or_copy(path, dest)
+            os.utime(path, None)
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+        return True
+
+    def store(self, key, source):
+        """ Add the file source to the cache under key. """
+        path = self.path(key, os.path.basename(source))
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        link_or_copy(source, path)
+
+    def entries(self):
+        """ (mtime, size, path) of every entry in the cache. """
+        for root, dirs, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield st.st_mtime, st.st_size, path
+
+    def evict(self):
+        """ Remove the least recently used entries until the cache holds at
+        most max_size bytes. Returns the bytes freed. """
+        entries = sorted(self.entries())
+        size = sum(entry[1] for entry in entries)
+        freed = 0
+        for mtime, entry_size, path in entries:
+            if size - freed <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+            freed += entry_size
+        if freed:
+            logger.log.info("Evicted %d bytes from the rpm cache %s" % \
+                            (freed, self.cache_dir))
+        return freed
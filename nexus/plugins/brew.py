@@ -10,13 +10,40 @@
 # Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
 # Boston, MA 02110-1301, USA.
 
-import koji as brew
 import os
-from nexus.lib import factory
+import json
+import threading
 from nexus.lib import logger
+from nexus.lib.downloader import Downloader
+from nexus.lib.downloader import rpm_download
+from nexus.lib.downloader import local_path
+from nexus.lib.kojicache import KojiCache
+from nexus.lib.kojicache import latest_rpms
 
-pathinfo = brew.PathInfo(topdir='http://download.lab.bos.redhat.com/brewroot')
-brew = brew.ClientSession('http://brewhub.devel.redhat.com/brewhub')
+MANIFEST = 'manifest.json'
+
+DEFAULT_BREW_HUB = 'http://brewhub.devel.redhat.com/brewhub'
+DEFAULT_BREW_ROOT = 'http://download.lab.bos.redhat.com/brewroot'
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def hub_session(conf_dict):
+    """
+    koji ClientSession and PathInfo for the brew_hub and brew_root of the
+    [brew] section of the conf. koji is imported and the session created on
+    first use, not when this module is imported, and reused afterwards.
+    """
+    section = conf_dict.get('brew', {})
+    hub = section.get('brew_hub') or DEFAULT_BREW_HUB
+    root = section.get('brew_root') or DEFAULT_BREW_ROOT
+    with _sessions_lock:
+        if (hub, root) not in _sessions:
+            import koji
+            logger.log.info("Connecting to brew hub %s" % hub)
+            _sessions[hub, root] = (koji.ClientSession(hub),
+                                    koji.PathInfo(topdir=root))
+        return _sessions[hub, root]
 
 class Brew():
 
@@ -75,44 +102,113 @@ class Brew():
             self.brew_builds = [item.strip() for item in builds.split(',')]
             logger.log.info("Builds to download: %s" % self.brew_builds)
 
-    def download_rpms(self, rpmurl):
+    def download_rpms(self, rpms, conf_dict):
         """
-        Download rpms using wget in threads.
+        Download rpms, hub rpm dicts with their 'url', into
+        build_download_loc on the parallel downloader, largest first. rpms
+        are verified against the payload hash from the hub and cached by
+        NVRA and payload hash. If brew_mount is set and mounted, rpms found
+        under it are copied from there instead.
         """
+        section = conf_dict.get('brew', {})
+        root = section.get('brew_root') or DEFAULT_BREW_ROOT
+        mount = section.get('brew_mount')
+        downloads = [rpm_download(rpm, self.build_download_loc,
+                                  local_path(rpm['url'], root, mount))
+                     for rpm in rpms]
+        Downloader.from_conf(conf_dict, 'brew').fetch_all(downloads)
 
-        import wget
-        filename = wget.download(rpmurl, self.build_download_loc)
+    def get_tagged(self, conf_dict):
+        """
+        Resolves the latest tagged builds of every item in brew_builds and
+        their rpms for brew_arch and noarch. The hub is queried with two
+        multicalls, one listTagged per item and one listRPMs per build, so
+        the whole tag costs two round trips, and answers are cached as
+        described in nexus.lib.kojicache. Returns the rpm dicts from the
+        hub with the download URL added as 'url' and the NVR of their build
+        as 'build_nvr'.
+        """
+        hub, pathinfo = hub_session(conf_dict)
+        cache = KojiCache.from_conf(hub, conf_dict)
+        return latest_rpms(cache, pathinfo, self.brew_tag, self.brew_builds,
+                           [self.brew_arch, "noarch"])
 
-    def get_tagged(self, item, conf_dict):
+    def get_latest(self, options, conf_dict):
         """
-        This function constructs the download build URL for each rpm and
-        creates a list of all the rpms in each build. This rpms list is then
-        passed on to threads along with download_rpms().
+        Resolves the rpms to download with get_tagged() and downloads them.
+        The first failed download cancels the ones that have not started yet.
         """
-        if item is None:
-            builds = brew.listTagged(self.brew_tag, latest=True, type=None,
-                                     inherit=True)
-        else:
-            builds = brew.listTagged(self.brew_tag, latest=True, package=item,
-                                     type=None, inherit=True)
-        for build in builds:
-            buildpath = pathinfo.build(build)
-            arches_noarch = (self.brew_arch, "noarch")
-            for arches in arches_noarch:
-                rpms = brew.listRPMs(build['id'], arches=arches)
-                rpms_list = []
-                for rpm in rpms:
-                    rpmpath = pathinfo.rpm(rpm)
-                    rpmurl = os.path.join(buildpath, rpmpath)
-                    rpms_list.append(rpmurl)
-                    self.download_rpms(rpmurl)
-                    logger.log.info("Downloading %s" % rpmurl)
+        self.download_rpms(self.get_tagged(conf_dict), conf_dict)
 
+    def manifest_path(self):
+        return os.path.join(self.build_download_loc, MANIFEST)
 
-    def get_latest(self, options, conf_dict):
+    def read_manifest(self):
+        """ Manifest of the last sync to build_download_loc, or None if
+        there is none for the same tag and arch. """
+        try:
+            with open(self.manifest_path()) as f:
+                manifest = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if manifest.get('tag') != self.brew_tag or \
+           manifest.get('arch') != self.brew_arch:
+            logger.log.info("Last sync was for %s/%s, syncing everything" % \
+                            (manifest.get('tag'), manifest.get('arch')))
+            return None
+        return manifest
+
+    def write_manifest(self, rpms):
         """
-        Opens thread for each build provided and calls get_tagged()
+        Writes build_download_loc/manifest.json: the tag and arch synced,
+        the rpm file names of every build NVR under 'builds' and the NVR,
+        payload hash and size of every rpm file under 'rpms'.
+        """
+        manifest = {'tag': self.brew_tag, 'arch': self.brew_arch,
+                    'builds': {}, 'rpms': {}}
+        for rpm in rpms:
+            name = os.path.basename(rpm['url'])
+            manifest['builds'].setdefault(rpm['build_nvr'], []).append(name)
+            manifest['rpms'][name] = {'nvr': rpm['build_nvr'],
+                                      'payloadhash': rpm.get('payloadhash'),
+                                      'size': rpm.get('size')}
+        for names in manifest['builds'].values():
+            names.sort()
+        path = self.manifest_path()
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.rename(path + '.tmp', path)
+        return manifest
+
+    def sync(self, conf_dict):
         """
-        fac = factory.Threader()
-        fac.gather_results([fac.get_item(self.get_tagged, item, conf_dict) \
-                            for item in self.brew_builds])
+        Brings build_download_loc up to date with the latest builds of the
+        tag. Only rpms that are new or changed since the manifest of the
+        last sync are downloaded, rpms of builds no longer tagged are
+        removed and the manifest is rewritten.
+        """
+        rpms = self.get_tagged(conf_dict)
+        old = self.read_manifest() or {'builds': {}, 'rpms': {}}
+        current = set(rpm['build_nvr'] for rpm in rpms)
+        previous = set(old['builds'])
+        logger.log.info("Sync of %s: %d builds added, %d removed, %d unchanged" % \
+                        (self.brew_tag, len(current - previous),
+                         len(previous - current), len(current & previous)))
+
+        wanted = set()
+        changed = []
+        for rpm in rpms:
+            name = os.path.basename(rpm['url'])
+            wanted.add(name)
+            known = old['rpms'].get(name, {})
+            if known.get('payloadhash') != rpm.get('payloadhash') or \
+               not os.path.exists(os.path.join(self.build_download_loc, name)):
+                changed.append(rpm)
+        self.download_rpms(changed, conf_dict)
+
+        for name in set(old['rpms']) - wanted:
+            path = os.path.join(self.build_download_loc, name)
+            if os.path.exists(path):
+                logger.log.info("Removing %s" % path)
+                os.unlink(path)
+        return self.write_manifest(rpms)
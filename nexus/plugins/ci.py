@@ -13,6 +13,9 @@
 
 from nexus.lib import logger
 from nexus.lib import factory
+from nexus.lib.hostgroup import HostGroup
+from nexus.lib.reposerver import RepoServer
+from nexus.lib.reposerver import createrepo
 from nexus.plugins.brew import Brew
 from nexus.plugins.git import Git
 from nexus.plugins.restraint import Restraint
@@ -26,63 +29,116 @@ class CI():
         self.provisioner = options.provisioner
         self.framework = options.framework
 
+    def preflight(self, conf_dict):
+        """
+        Connect to all test resources concurrently before any stage starts,
+        so an unreachable node fails the job, or is dropped from it, right
+        away instead of deep inside a stage.
+        """
+        if self.provisioner == "openstack":
+            nodes_key = 'private_ips'
+        else:
+            nodes_key = 'existing_nodes'
+
+        if self.provisioner not in conf_dict or nodes_key not in conf_dict['jenkins']:
+            logger.log.warn("No test resources to check before the run")
+            return
+
+        section = conf_dict.get('preflight', {})
+        retries = int(section.get('retries', 5))
+        backoff = float(section.get('backoff', factory.DEFAULT_CONNECT_BACKOFF))
+        drop = section.get('drop_unreachable', 'no').lower() in ('yes', 'true', '1')
+
+        nodes = [item.strip() for item in conf_dict['jenkins'][nodes_key].split(',')]
+        group = HostGroup.from_conf(nodes, conf_dict[self.provisioner]['username'],
+                                    conf_dict[self.provisioner]['password'], conf_dict)
+        logger.log.info("Checking that %d test resources are reachable" % len(nodes))
+        group.preflight(retries, backoff, drop)
+
+        if group.hosts != nodes:
+            conf_dict['jenkins'][nodes_key] = ",".join(group.hosts)
+
+    def serve_builds(self, conf_dict):
+        """
+        Generate repodata for the builds in build_download_loc of the brew
+        section and serve them over HTTP from this slave. The URL is stored
+        as url in the repo_server section for Repos to point the test
+        resources at.
+        """
+        directory = conf_dict['brew']['build_download_loc']
+        createrepo(directory)
+        server = RepoServer.from_conf(directory, conf_dict).start()
+        conf_dict.setdefault('repo_server', {})['url'] = server.url
+        return server
+
     def run(self, options, conf_dict):
-        if self.provisioner == "beaker" and self.framework == "restraint":
-            git = Git(options, conf_dict)
-            git.get_archive()
+        self.preflight(conf_dict)
 
-            repo = Repos(options, conf_dict)
-            repo.run_repo_setup(options, conf_dict)
+        server = None
+        if options.serve_builds:
+            server = self.serve_builds(conf_dict)
 
-            restraint = Restraint(options, conf_dict)
+        try:
+            if self.provisioner == "beaker" and self.framework == "restraint":
+                git = Git(options, conf_dict)
+                git.get_archive()
 
-            """ This function actually runs restraint command and
-            executed the job on beaker.
-            """
-            restraint.run_restraint(options, conf_dict)
+                repo = Repos(options, conf_dict)
+                repo.run_repo_setup(options, conf_dict)
 
-        elif self.provisioner == "beaker" and self.framework == "pytest":
+                restraint = Restraint(options, conf_dict)
 
-            repo = Repos(options, conf_dict)
-            repo.run_repo_setup(options, conf_dict)
+                """ This function actually runs restraint command and
+                executed the job on beaker.
+                """
+                restraint.run_restraint(options, conf_dict)
 
-            pytest = Pytest(options, conf_dict)
-            pytest.run_pytest(options, conf_dict)
+            elif self.provisioner == "beaker" and self.framework == "pytest":
 
-            if options.coverage is True:
-                logger.log.info("Get coverage report")
-                coverage = Testcoverage(options, conf_dict)
-                coverage.coverage_reports(options, conf_dict)
-                coverage.get_reports(options, conf_dict)
-            else:
-                logger.log.info("No coverage report since option not set")
+                repo = Repos(options, conf_dict)
+                repo.run_repo_setup(options, conf_dict)
 
-        elif self.provisioner == "openstack" and self.framework == "pytest":
+                pytest = Pytest(options, conf_dict)
+                pytest.run_pytest(options, conf_dict)
 
-            repo = Repos(options, conf_dict)
-            repo.run_repo_setup(options, conf_dict)
+                if options.coverage is True:
+                    logger.log.info("Get coverage report")
+                    coverage = Testcoverage(options, conf_dict)
+                    coverage.coverage_reports(options, conf_dict)
+                    coverage.get_reports(options, conf_dict)
+                else:
+                    logger.log.info("No coverage report since option not set")
 
-            pytest = Pytest(options, conf_dict)
-            pytest.run_pytest(options, conf_dict)
+            elif self.provisioner == "openstack" and self.framework == "pytest":
 
-            if options.coverage is True:
-                logger.log.info("Get coverage report")
-                coverage = Testcoverage(options, conf_dict)
-                coverage.coverage_reports(options, conf_dict)
-                coverage.get_reports(options, conf_dict)
-            else:
-                logger.log.info("No coverage report since option not set")
+                repo = Repos(options, conf_dict)
+                repo.run_repo_setup(options, conf_dict)
 
-        elif self.provisioner == "openstack" and self.framework == "restraint":
+                pytest = Pytest(options, conf_dict)
+                pytest.run_pytest(options, conf_dict)
 
-            git = Git(options, conf_dict)
-            git.get_archive()
+                if options.coverage is True:
+                    logger.log.info("Get coverage report")
+                    coverage = Testcoverage(options, conf_dict)
+                    coverage.coverage_reports(options, conf_dict)
+                    coverage.get_reports(options, conf_dict)
+                else:
+                    logger.log.info("No coverage report since option not set")
 
-            repo = Repos(options, conf_dict)
-            repo.run_repo_setup(options, conf_dict)
+            elif self.provisioner == "openstack" and self.framework == "restraint":
 
-            restraint = Restraint(options, conf_dict)
-            restraint.run_restraint(options, conf_dict)
+                git = Git(options, conf_dict)
+                git.get_archive()
 
-        else:
-            logger.log.error("Unknown provisioner or framework")
+                repo = Repos(options, conf_dict)
+                repo.run_repo_setup(options, conf_dict)
+
+                restraint = Restraint(options, conf_dict)
+                restraint.run_restraint(options, conf_dict)
+
+            else:
+                logger.log.error("Unknown provisioner or framework")
+        finally:
+            # also on a failed stage or sys.exit, or the port stays taken
+            if server is not None:
+                server.stop()
@@ -11,10 +11,16 @@
 # Boston, MA 02110-1301, USA.
 
 import os
-import wget
 import xmlrpclib
-from nexus.lib import factory
 from nexus.lib import logger
+from nexus.lib.downloader import Download
+from nexus.lib.downloader import Downloader
+from nexus.lib.downloader import rpm_download
+from nexus.lib.downloader import local_path
+from nexus.lib.kojicache import multicall
+from nexus.lib.factory import WorkerPool
+from nexus.lib.factory import max_workers
+from nexus.plugins.brew import hub_session
 
 class Errata():
 
@@ -25,6 +31,8 @@ class Errata():
         else:
             self.errata_id = options.errata_id
         logger.log.info("Errata id is %s" % self.errata_id)
+        self.errata_ids = [i.strip() for i in str(self.errata_id).split(',')
+                           if i.strip()]
 
         self.errata_xmlrpc = conf_dict['errata']['xmlrpc_url']
         self.errata_download = conf_dict['errata']['download_devel']
@@ -34,6 +42,7 @@ class Errata():
         else:
             self.errata_download_loc = options.errata_loc
         self.errata_mount_base = conf_dict['errata']['mount_base']
+        self.max_workers = max_workers(conf_dict, 'errata')
 
         if not os.path.exists(self.errata_download_loc):
             os.makedirs(self.errata_download_loc)
@@ -43,32 +52,76 @@ class Errata():
         except NameError:
             print "xmlrpc_url or errata_id is not defined"
 
+    def get_errata_packages(self, errata_id):
+        """ Build URLs of a single erratum. Every call has its own
+        ServerProxy, they are not safe to share between threads. """
+
+        et_rpc_proxy = xmlrpclib.ServerProxy(self.errata_xmlrpc)
+        response = et_rpc_proxy.getErrataPackages(errata_id)
+        logger.log.info("Errata %s has %d packages" % (errata_id, len(response)))
+        return [w.replace(self.errata_mount_base, self.errata_download) for w in response]
+
     def get_package_url(self):
         """ This function returns the response received from xmlrpc server.
-        In this case, it returns build URL.
+        In this case, it returns build URL. With several errata ids they are
+        queried concurrently and the URLs they share are merged.
         """
 
-        et_rpc_proxy = xmlrpclib.ServerProxy(self.errata_xmlrpc)
-        response = et_rpc_proxy.getErrataPackages(self.errata_id)
-
-        response = [w.replace(self.errata_mount_base, self.errata_download) for w in response]
-        response = set(response)
+        pool = WorkerPool(self.max_workers, fail_fast=True)
+        try:
+            responses = pool.map(self.get_errata_packages, self.errata_ids)
+        finally:
+            pool.shutdown()
+
+        response = set()
+        for urls in responses:
+            response.update(urls)
+        total = sum(len(urls) for urls in responses)
+        if total > len(response):
+            logger.log.info("%d packages shared between errata downloaded once" % \
+                            (total - len(response)))
         return response
 
-    def download_rpms(self, rpm_url):
-        """ Download builds using wget """
-
-        filename = wget.download(rpm_url, self.errata_download_loc)
-
-    def download_errata_builds(self):
-        """ Function to iterate through the rpm set
-        and call download_rpms function
-        """
-
-        rpm_set = self.get_package_url()
+    def lookup_rpms(self, urls, conf_dict=None):
+        """ Hub rpm dicts of the rpms at urls by url, looked up by their NVRA
+        on the brew hub with a single getRPM multicall. rpms the hub does not
+        know are left out, and so is every rpm if the hub can't be reached. """
 
+        nvras = [os.path.basename(url)[:-len('.rpm')] for url in urls]
+        try:
+            hub, pathinfo = hub_session(conf_dict or {})
+            results = multicall(hub, [('getRPM', (nvra,), {}) for nvra in nvras])
+        except Exception as e:
+            logger.log.warn("Could not look up the errata rpms on the brew "
+                            "hub, caching them by URL: %s" % e)
+            return {}
+        rpms = {}
+        for url, rpm in zip(urls, results):
+            if rpm:
+                rpm['url'] = url
+                rpms[url] = rpm
+        logger.log.info("%d of %d errata rpms found on the brew hub" % \
+                        (len(rpms), len(urls)))
+        return rpms
+
+    def download_errata_builds(self, conf_dict=None):
+        """ Download every rpm of the errata on the parallel downloader.
+        rpms the brew hub knows are verified against their payload hash and
+        cached by NVRA and payload hash like brew rpms, the others by URL.
+        rpms are copied from mount_base instead if it is mounted here. """
+
+        rpm_set = sorted(self.get_package_url())
+        rpms = self.lookup_rpms(rpm_set, conf_dict)
+        downloads = []
         for rpm_url in rpm_set:
             logger.log.info(rpm_url)
-            rpm_name = os.path.basename(rpm_url)
-            logger.log.info("Downloading %s" % rpm_url)
-            self.download_rpms(rpm_url)
+            local = local_path(rpm_url, self.errata_download, self.errata_mount_base)
+            if rpm_url in rpms:
+                downloads.append(rpm_download(rpms[rpm_url], self.errata_download_loc,
+                                              local))
+            else:
+                downloads.append(Download(rpm_url,
+                                          os.path.join(self.errata_download_loc,
+                                                       os.path.basename(rpm_url)),
+                                          local=local))
+        Downloader.from_conf(conf_dict or {}, 'errata').fetch_all(downloads)
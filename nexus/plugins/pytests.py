@@ -17,8 +17,9 @@ import glob
 import subprocess
 import shutil
 from scp import SCPClient
-from nexus.lib.factory import SSHClient
-from nexus.lib.factory import Threader
+from nexus.lib.factory import ssh_pool
+from nexus.lib.factory import FileStep
+from nexus.lib.hostgroup import HostGroup
 from nexus.lib import logger
 from nexus.lib.ci_message import CI_MSG
 from nexus.plugins.testcoverage import Testcoverage
@@ -41,6 +42,8 @@ class Pytest():
             logger.log.error("Unknown provisioner")
 
         self.existing_nodes = [item.strip() for item in nodes.split(',')]
+        self.nodes = HostGroup.from_conf(self.existing_nodes, self.username,
+                                         self.password, conf_dict)
         self.workspace = conf_dict['jenkins']['workspace']
         self.jenkins_job_name = conf_dict['jenkins']['job_name']
         self.ssh_keys_priv = conf_dict['pytest']['ssh_keys_priv']
@@ -53,68 +56,48 @@ class Pytest():
     def deploy_ssh_keys(self, host, conf_dict):
         """ Copy ssh keys to all existing nodes """
 
-        ssh_c = SSHClient(hostname = host, username = \
-                        self.username, password = self.password)
+        ssh_c = ssh_pool.get(host, self.username, self.password)
 
-        stdin, stdout, stderr = ssh_c.ExecuteCmd('mkdir -p ~/.ssh/')
-        for line in stdout.read().splitlines(): logger.log.info(line)
-
-        source = self.ssh_keys_priv
-        destination = "/root/.ssh/id_rsa"
-        logger.log.info("Copying %s to %s on %s" % (source, destination, host))
-        ssh_c.CopyFiles(source, destination)
-
-        source = self.ssh_keys_pub
-        destination = "/root/.ssh/authorized_keys"
-        logger.log.info("Copying %s to %s on %s" % (source, destination, host))
-        ssh_c.CopyFiles(source, destination)
-
-        stdin, stdout, stderr = ssh_c.ExecuteCmd('chmod 644 /root/.ssh/authorized_keys')
-        for line in stdout.read().splitlines(): logger.log.info(line)
-
-        stdin, stdout, stderr = ssh_c.ExecuteCmd('chmod 600 /root/.ssh/id_rsa')
-        for line in stdout.read().splitlines(): logger.log.info(line)
-
-        stdin, stdout, stderr = ssh_c.ExecuteCmd('chmod 700 /root/.ssh/')
-        for line in stdout.read().splitlines(): logger.log.info(line)
-
-        stdin, stdout, stderr = ssh_c.ExecuteCmd('echo "StrictHostKeyChecking no" >> /root/.ssh/config')
-        for line in stdout.read().splitlines(): logger.log.info(line)
+        logger.log.info("Copying %s to /root/.ssh/id_rsa on %s" % \
+                        (self.ssh_keys_priv, host))
+        logger.log.info("Copying %s to /root/.ssh/authorized_keys on %s" % \
+                        (self.ssh_keys_pub, host))
+        ssh_c.ExecuteBatch([
+            'mkdir -p ~/.ssh/',
+            FileStep(self.ssh_keys_priv, "/root/.ssh/id_rsa", 0600),
+            FileStep(self.ssh_keys_pub, "/root/.ssh/authorized_keys", 0644),
+            'chmod 700 /root/.ssh/',
+            'echo "StrictHostKeyChecking no" >> /root/.ssh/config'])
 
 
     def copy_extras_repo(self, host, conf_dict):
         """ Use yum-config-manager to create repo using a repo url """
 
-        ssh_c = SSHClient(hostname = host, username = \
-                        self.username, password = self.password)
+        ssh_c = ssh_pool.get(host, self.username, self.password)
 
         self.extras_repo = conf_dict['pytest']['extras_repo']
 
         logger.log.info("Adding extras repo to %s", host)
         copy_extras_repo_cmd = "yum-config-manager --add-repo " + self.extras_repo
 
-        stdin, stdout, stderr = ssh_c.ExecuteCmd(copy_extras_repo_cmd)
-        for line in stdout.read().splitlines(): logger.log.info(line)
+        ssh_c.ExecuteLogged(copy_extras_repo_cmd)
 
     def install_prereqs(self, host, conf_dict):
         """ Install pre-reqs for pytest """
 
-        ssh_c = SSHClient(hostname = host, username = \
-                        self.username, password = self.password)
+        ssh_c = ssh_pool.get(host, self.username, self.password)
 
         prereqs = conf_dict['pytest']['pytest_prereq']
         self.prereqs = [item.strip() for item in prereqs.split(',')]
         self.prereqs_rpms = " ".join(self.prereqs)
         install_cmd = "yum install -y --nogpgcheck " + self.prereqs_rpms
         logger.log.info("Installing %s on %s" % (self.prereqs_rpms, host))
-        stdin, stdout, stderr = ssh_c.ExecuteCmd(install_cmd)
-        for line in stdout.read().splitlines(): logger.log.info(line)
+        ssh_c.ExecuteLogged(install_cmd)
 
     def pytest_setup(self, host, conf_dict):
         """ setup pytest automation """
 
-        ssh_c = SSHClient(hostname = host, username = \
-                        self.username, password = self.password)
+        ssh_c = ssh_pool.get(host, self.username, self.password)
 
         self.tests_cfg = conf_dict['pytest']['tests_cfg']
 
@@ -123,8 +106,7 @@ class Pytest():
         get_tests = git_clone + self.git_repo_url
 
         logger.log.info("git cloning %s on %s" % (self.git_repo_url, host))
-        stdin, stdout, stderr = ssh_c.ExecuteCmd(get_tests)
-        for line in stdout.read().splitlines(): logger.log.info(line)
+        ssh_c.ExecuteLogged(get_tests)
 
         self.git_refspec = os.environ.get("GERRIT_REFSPEC")
         if self.git_refspec:
@@ -134,8 +116,7 @@ class Pytest():
                             + self.gerrit_repo_url + " " + self.git_refspec + "; cd .."
             logger.log.info("Git pull %s" % self.git_refspec)
 
-            stdin, stdout, stderr = ssh_c.ExecuteCmd(git_pull_cmd)
-            for line in stdout.read().splitlines(): logger.log.info(line)
+            ssh_c.ExecuteLogged(git_pull_cmd)
         else:
             logger.log.info("GERRIT REFSPEC is empty.")
 
@@ -149,15 +130,13 @@ class Pytest():
 
         logger.log.info("Installing pytests on all nodes.")
         self.tests_base = conf_dict['pytest']['tests_base']
-        stdin, stdout, stderr = ssh_c.ExecuteCmd('cd ' + self.tests_base  + '; python setup.py install')
-        for line in stdout.read().splitlines(): logger.log.info(line)
+        ssh_c.ExecuteLogged('cd ' + self.tests_base  + '; python setup.py install')
 
     def copy_testout_junit(self, options, conf_dict):
         """ Copy junit file from first node to Jenkins slave """
 
         master = self.existing_nodes[0]
-        ssh_c = SSHClient(hostname = master, username = \
-                        self.username, password = self.password)
+        ssh_c = ssh_pool.get(master, self.username, self.password)
         remote_file = conf_dict['pytest']['pytest_junit_loc']
 
         scp = SCPClient(ssh_c.get_transport())
@@ -178,8 +157,7 @@ class Pytest():
                         remote_file + " -o " + self.junit_new_out + " -t " + self.team + \
                         " -p " + self.package + " -s " + self.test_suite
 
-        stdin, stdout, stderr = ssh_c.ExecuteCmd(massage_junit)
-        for line in stdout.read().splitlines(): logger.log.info(line)
+        ssh_c.ExecuteLogged(massage_junit)
 
         scp = SCPClient(ssh_c.get_transport())
         scp.get(self.junit_new_out)
@@ -188,23 +166,14 @@ class Pytest():
     def run_pytest(self, options, conf_dict):
         """ Run pytest command using the marker if provided """
 
-        threads = Threader()
 
-        threads.gather_results([threads.get_item(self.deploy_ssh_keys, \
-                                host, conf_dict) for host in \
-                                self.existing_nodes])
+        self.nodes.map(self.deploy_ssh_keys, conf_dict)
 
-        threads.gather_results([threads.get_item(self.install_prereqs, \
-                                host, conf_dict) for host in \
-                                self.existing_nodes])
+        self.nodes.map(self.install_prereqs, conf_dict)
 
-        threads.gather_results([threads.get_item(self.copy_extras_repo, \
-                                host, conf_dict) for host in \
-                                self.existing_nodes])
+        self.nodes.map(self.copy_extras_repo, conf_dict)
 
-        threads.gather_results([threads.get_item(self.install_prereqs, \
-                                host, conf_dict) for host in \
-                                self.existing_nodes])
+        self.nodes.map(self.install_prereqs, conf_dict)
 
         logger.log.info("Updating %s with existing_nodes information" % self.tests_cfg)
 
@@ -224,9 +193,7 @@ class Pytest():
             node = node + 1
             host_num = host_num + 1
 
-        threads.gather_results([threads.get_item(self.pytest_setup, \
-                                host, conf_dict) for host in \
-                                self.existing_nodes])
+        self.nodes.map(self.pytest_setup, conf_dict)
 
         if options.coverage is True:
             coverage = Testcoverage(options, conf_dict)
@@ -286,20 +253,13 @@ class Pytest():
 
         host = self.existing_nodes[0]
 
-        ssh_c = SSHClient(hostname = host, username = \
-                        self.username, password = self.password)
-        stdout,stderr,exit_status = ssh_c.ExecuteScript(pytest_cmd)
-        output = stdout.getvalue()
-        error = stderr.getvalue()
-
-        if error:
-            print "error running script: ", error
-            print "Exit status : ", exit_status
-        else:
-            print "Script Output: ", output
+        ssh_c = ssh_pool.get(host, self.username, self.password)
+        result = ssh_c.ExecuteLogged(pytest_cmd)
 
-        stdout.close()
-        stderr.close()
+        if result.exit_status != 0:
+            logger.log.error("py.test exited with %s on %s" % \
+                             (result.exit_status, host))
+            for line in result.stderr_tail: logger.log.error(line)
 
         try:
             self.copy_testout_junit(options, conf_dict)
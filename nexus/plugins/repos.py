@@ -12,12 +12,17 @@
 
 import os
 import sys
+import pipes
 import platform
-from nexus.lib.factory import SSHClient
-from nexus.lib.factory import Threader
+from nexus.lib.factory import ssh_pool
+from nexus.lib.hostgroup import HostGroup
+from nexus.lib import facts
 from nexus.lib.factory import Platform
+from nexus.lib.reposerver import repo_file
 from nexus.lib import logger
 
+PUSHED_BUILDS_DIR = "/var/tmp/nexus-builds"
+
 class Repos():
 
     def __init__(self, options, conf_dict):
@@ -36,6 +41,8 @@ class Repos():
         self.framework = options.framework
         nodes = conf_dict['jenkins']['existing_nodes']
         self.existing_nodes = [item.strip() for item in nodes.split(',')]
+        self.nodes = HostGroup.from_conf(self.existing_nodes, self.username,
+                                         self.password, conf_dict)
         self.repos_section = 'repos'
 
         self.jenkins_job_name = conf_dict['jenkins']['job_name']
@@ -56,8 +63,7 @@ class Repos():
         destination = "/etc/yum.repos.d/my_build.repo"
 
         logger.log.info("Copying %s to %s on %s" % (source, destination, host))
-        ssh_c = SSHClient(hostname = host, username = \
-                self.username, password = self.password)
+        ssh_c = ssh_pool.get(host, self.username, self.password)
         ssh_c.CopyFiles(source, destination)
 
     def copy_build_repo(self, host, conf_dict):
@@ -86,13 +92,42 @@ class Repos():
             logger.log.info("source file is %s" % source)
             logger.log.info("destination file is %s" % destination)
 
-            ssh_c = SSHClient(hostname = host, username = \
-                                      self.username, password = self.password)
+            ssh_c = ssh_pool.get(host, self.username, self.password)
             ssh_c.CopyFiles(source, destination)
         else:
             logger.log.info("Destination %s is %s" % (host, dist))
             logger.log.info("Not adding repo file to %s" % host)
 
+    def copy_served_repo(self, url):
+        """
+        Point all the existing nodes at the builds served from the slave by
+        nexus ci --serve-builds.
+        """
+        source = "nexus-builds.repo"
+        with open(source, "w") as repo:
+            repo.write(repo_file("nexus-builds", url))
+        self.nodes.put(source, "/etc/yum.repos.d/" + source)
+
+    def push_builds(self, directory):
+        """
+        Send the builds in directory to all the existing nodes as one tar
+        stream per node, all nodes at once, then install them on each node
+        with yum localinstall. Used by nexus ci --push-builds when the nodes
+        can not reach the download servers quickly. What earlier runs left
+        on the nodes is removed first and only the rpms pushed are
+        installed.
+        """
+        rpms = sorted(f for f in os.listdir(directory) if f.endswith('.rpm'))
+        if not rpms:
+            logger.log.warn("No rpms in %s to push" % directory)
+            return
+        logger.log.info("Pushing %d rpms in %s to %s" % \
+                        (len(rpms), directory, ", ".join(self.existing_nodes)))
+        self.nodes.run("rm -rf %s" % PUSHED_BUILDS_DIR)
+        self.nodes.put_tree(directory, PUSHED_BUILDS_DIR)
+        self.nodes.run("cd %s && yum localinstall -y --nogpgcheck %s" % \
+                       (PUSHED_BUILDS_DIR, " ".join(pipes.quote(rpm) for rpm in rpms)))
+
     def copy_async_updates_repo(self, host, conf_dict):
         """copy the async updates repo to all the existing nodes"""
 
@@ -122,8 +157,7 @@ class Repos():
             logger.log.info("source file is %s" % source)
             logger.log.info("destination file is %s" % destination)
 
-            ssh_c = SSHClient(hostname = host, username = \
-                                      self.username, password = self.password)
+            ssh_c = ssh_pool.get(host, self.username, self.password)
             ssh_c.CopyFiles(source, destination)
         except KeyError, e:
             logger.log.error("%s key for async_updates_url does not exists in conf." % e)
@@ -155,11 +189,9 @@ class Repos():
 
             logger.log.info("Adding task_repo %s to %s" % (r[0], host))
             copy_task_repo_cmd = "yum-config-manager --add-repo " + r[0]
-            ssh_c = SSHClient(hostname = host, username = \
-                                  self.username, password = self.password)
+            ssh_c = ssh_pool.get(host, self.username, self.password)
 
-            stdin, stdout, stderr = ssh_c.ExecuteCmd(copy_task_repo_cmd)
-            for line in stdout.read().splitlines(): logger.log.info(line)
+            ssh_c.ExecuteLogged(copy_task_repo_cmd)
         else:
             logger.log.info("TASK_REPO_URLS env variable not found")
 
@@ -179,11 +211,9 @@ class Repos():
             self.static_repo_url_arch = self.static_repo_url + "/" + self.brew_arch
             logger.log.info("Adding static_repo %s to %s" % (self.static_repo_url_arch, host))
             copy_static_repo_cmd = "yum-config-manager --add-repo " + self.static_repo_url_arch
-            ssh_c = SSHClient(hostname = host, username = \
-                                      self.username, password = self.password)
+            ssh_c = ssh_pool.get(host, self.username, self.password)
 
-            stdin, stdout, stderr = ssh_c.ExecuteCmd(copy_static_repo_cmd)
-            for line in stdout.read().splitlines(): logger.log.info(line)
+            ssh_c.ExecuteLogged(copy_static_repo_cmd)
         else:
             logger.log.info("%s is not for %s dist" % (self.static_repo_url, dist))
 
@@ -194,8 +224,7 @@ class Repos():
         urls provided in repos section
         """
 
-        ssh_c = SSHClient(hostname = host, username = \
-                self.username, password = self.password)
+        ssh_c = ssh_pool.get(host, self.username, self.password)
 
         repo_section_name = conf_dict[self.repos_section]
         for key, value in repo_section_name.iteritems():
@@ -203,8 +232,7 @@ class Repos():
             logger.log.info("Adding repo %s to %s" % (value, host))
             copy_static_repo_cmd = "yum-config-manager --add-repo " + value
 
-            stdin, stdout, stderr = ssh_c.ExecuteCmd(copy_static_repo_cmd)
-            for line in stdout.read().splitlines(): logger.log.info(line)
+            ssh_c.ExecuteLogged(copy_static_repo_cmd)
 
 
     def install_yum_utils(self, host, conf_dict):
@@ -213,8 +241,7 @@ class Repos():
         available on all the hosts to configure yum repos and disable gpgcheck.
         """
 
-        ssh_c = SSHClient(hostname = host, username = \
-                self.username, password = self.password)
+        ssh_c = ssh_pool.get(host, self.username, self.password)
 
         if self.provisioner == 'openstack' and self.framework == 'restraint':
             logger.log.info("Install packages requried for restraint with openstack")
@@ -224,14 +251,10 @@ class Repos():
             install_yum_utils_cmd = "yum install -y --nogpgcheck yum-utils"
             logger.log.info("Installing yum-utils on %s" % host)
 
-        stdin, stdout, stderr = ssh_c.ExecuteCmd(install_yum_utils_cmd)
-        for line in stdout.read().splitlines(): logger.log.info(line)
-
         logger.log.info("Disabling gpgcheck in /etc/yum.conf on %s" % host)
         disable_gpgcheck = "echo gpgcheck=no >> /etc/yum.conf"
 
-        stdin, stdout, stderr = ssh_c.ExecuteCmd(disable_gpgcheck)
-        for line in stdout.read().splitlines(): logger.log.info(line)
+        ssh_c.ExecuteBatch([install_yum_utils_cmd, disable_gpgcheck])
 
 
     def run_repo_setup(self, options, conf_dict):
@@ -239,45 +262,38 @@ class Repos():
         run async_updates repo function using threads per host.
         """
 
-        threads = Threader()
+        facts.gather(self.existing_nodes, self.username, self.password, conf_dict)
 
-        threads.gather_results([threads.get_item(self.install_yum_utils, \
-                                host, conf_dict) for host in \
-                                self.existing_nodes])
+        self.nodes.map(self.install_yum_utils, conf_dict)
 
         if conf_dict.has_key('repos'):
             logger.log.info("repos section detected.")
-            threads.gather_results([threads.get_item(self.create_repos_section, \
-                                    host, conf_dict) for host in \
-                                    self.existing_nodes])
+            self.nodes.map(self.create_repos_section, conf_dict)
         else:
             logger.log.info("repos section not found.")
 
-        threads.gather_results([threads.get_item(self.install_yum_utils, \
-                                host, conf_dict) for host in \
-                                self.existing_nodes])
+        self.nodes.map(self.install_yum_utils, conf_dict)
 
         if self.build_repo_tag:
             logger.log.info("BUILD_REPO_TAG found in env")
-            threads.gather_results([threads.get_item(self.copy_build_repo, \
-                                    host, conf_dict) for host in \
-                                    self.existing_nodes])
+            self.nodes.map(self.copy_build_repo, conf_dict)
         else:
             logger.log.info("BUILD_REPO_TAG not found in env")
 
 
+        served_repo_url = conf_dict.get('repo_server', {}).get('url')
+        if served_repo_url:
+            logger.log.info("Builds served from %s" % served_repo_url)
+            self.copy_served_repo(served_repo_url)
+
         if options.build_repo:
             logger.log.info("Manual repo to be copied to resources.")
             self.build_repo = options.build_repo
-            threads.gather_results([threads.get_item(self.my_build_repo, \
-                                   host, conf_dict) for host in \
-                                   self.existing_nodes])
+            self.nodes.map(self.my_build_repo, conf_dict)
 
         if "z-candidate" in self.brew_tag:
             logger.log.info("brew tag is for z-candidate, hence picking batched repo from conf.")
-            threads.gather_results([threads.get_item(self.copy_async_updates_repo, \
-                                    host, conf_dict) for host in \
-                                    self.existing_nodes])
+            self.nodes.map(self.copy_async_updates_repo, conf_dict)
         else:
             logger.log.info("brew tag is not for z-candidate, hence not picking any batched repo from conf.")
 
@@ -287,16 +303,15 @@ class Repos():
             logger.log.info("STATIC_REPO_URLS from env variable is %s" % self.static_repo_url)
             logger.log.info("TASK_REPO_URLS from env variable is %s" % self.task_repo_urls)
             logger.log.info("Check and copy task_repo if dist is appropriate")
-            threads.gather_results([threads.get_item(self.copy_task_repo, \
-                                    host, conf_dict) for host in \
-                                    self.existing_nodes])
+            self.nodes.map(self.copy_task_repo, conf_dict)
         else:
             logger.log.info("TASK_REPO_URLS env variable not found")
 
         if self.static_repo_url:
             logger.log.info("Check and copy static_repo if dist is appropriate")
-            threads.gather_results([threads.get_item(self.copy_static_repo, \
-                                    host, conf_dict) for host in \
-                                    self.existing_nodes])
+            self.nodes.map(self.copy_static_repo, conf_dict)
         else:
             logger.log.info("STATIC_REPO_URLS env variable not found")
+
+        if getattr(options, 'push_builds', False):
+            self.push_builds(conf_dict['brew']['build_download_loc'])
@@ -11,16 +11,50 @@
 # Boston, MA 02110-1301, USA.
 
 import os
+import re
 import sys
 import platform
 import glob
 import subprocess
 import shutil
 import xml.etree.ElementTree as ET
-from nexus.lib.factory import SSHClient
-from nexus.lib.factory import Threader
+from nexus.lib.factory import ssh_pool
+from nexus.lib.hostgroup import HostGroup
+from nexus.lib import facts
 from nexus.lib.factory import Platform
 from nexus.lib import logger
+from nexus.lib.junit import job_to_junit
+
+# hostname<n> in a restraint xml stands for the n-th of existing_nodes
+HOSTNAME_TOKEN = re.compile(r'hostname(\d+)')
+
+# The updated job is written to RENDERED_PREFIX + the name of the restraint
+# xml in the current directory.
+RENDERED_PREFIX = "nexus-rendered-"
+
+# The XML declaration, doctype and comments ahead of the root element.
+PROLOG = re.compile(r'\s*(?:(?:<\?.*?\?>|<!--.*?-->|<!DOCTYPE[^>]*>)\s*)*', re.S)
+
+class CommentedTreeBuilder(ET.TreeBuilder):
+    """ TreeBuilder keeping the comments inside the root element, which
+    ElementTree drops by default. """
+
+    def comment(self, data):
+        if self._elem:
+            self.start(ET.Comment, {})
+            self.data(data)
+            self.end(ET.Comment)
+
+def xml_epilogue(content):
+    """ The comments and whitespace following the root element. """
+    start = len(content)
+    while True:
+        end = start
+        while end and content[end - 1].isspace():
+            end -= 1
+        if not content.endswith('-->', 0, end):
+            return content[end:]
+        start = content.rfind('<!--', 0, end)
 
 class Restraint():
 
@@ -40,6 +74,8 @@ class Restraint():
             logger.log.error("Unknown provisioner")
 
         self.existing_nodes = [item.strip() for item in nodes.split(',')]
+        self.nodes = HostGroup.from_conf(self.existing_nodes, self.username,
+                                         self.password, conf_dict)
         self.jenkins_job_name = conf_dict['jenkins']['job_name']
         self.build_repo_tag = os.environ.get("BUILD_REPO_TAG")
         self.git_refspec = os.environ.get("GERRIT_REFSPEC")
@@ -60,19 +96,16 @@ class Restraint():
         logger.log.info("Platform distribution for host %s is %s" % (host, dist))
         repo_out = "/etc/yum.repos.d/restraint.repo"
 
-        ssh_c = SSHClient(hostname = host, username = \
-                                  self.username, password = self.password)
+        ssh_c = ssh_pool.get(host, self.username, self.password)
         restraint_repo = conf_dict['restraint'][dist[1]]
         wget_cmd = "wget " + restraint_repo + " -O " + repo_out
         logger.log.info("%s to %s" % (host, wget_cmd))
-        stdin, stdout, stderr = ssh_c.ExecuteCmd(wget_cmd)
-        for line in stdout.read().splitlines(): logger.log.info(line)
+        steps = [wget_cmd]
 
         restraint_remove_rpms = conf_dict['restraint']['remove_rpm']
         remove_cmd = "yum remove -y " + restraint_remove_rpms
         logger.log.info("%s to %s" % (host, remove_cmd))
-        stdin, stdout, stderr = ssh_c.ExecuteCmd(remove_cmd)
-        for line in stdout.read().splitlines(): logger.log.info(line)
+        steps.append(remove_cmd)
 
         """
         Check if OS is rhel5.11 and modify yum.conf to install
@@ -83,21 +116,20 @@ class Restraint():
             yumconf_append = "echo 'multilib_policy = best' >> " + yumconf
             logger.log.info("%s is detected as 5.11. Setting multilib_policy \
                             best in /etc/yum.conf" % host)
-            stdin, stdout, stderr = ssh_c.ExecuteCmd(yumconf_append)
-            for line in stdout.read().splitlines(): logger.log.info(line)
+            steps.append(yumconf_append)
 
         restraint_install_rpms = conf_dict['restraint']['install_rpm']
         install_cmd = "yum install -y " + restraint_install_rpms
         logger.log.info("%s to %s" % (host, install_cmd))
-        stdin, stdout, stderr = ssh_c.ExecuteCmd(install_cmd)
-        for line in stdout.read().splitlines(): logger.log.info(line)
+        steps.append(install_cmd)
 
         service = ("restraintd")
         start_service_cmd = ("service %s start; chkconfig %s on" % (service, \
                             service))
         logger.log.info("%s to %s" % (host, start_service_cmd))
-        stdin, stdout, stderr = ssh_c.ExecuteCmd(start_service_cmd)
-        for line in stdout.read().splitlines(): logger.log.info(line)
+        steps.append(start_service_cmd)
+
+        ssh_c.ExecuteBatch(steps)
 
     def restraint_update_xml(self):
         """
@@ -106,74 +138,79 @@ class Restraint():
         URL and adds test branch name provided in conf file and if the
         value is default then use whatever is available in the restraint
         xml.
+
+        The xml is parsed once and every attribute and text is rewritten in
+        the same pass. The result is written to nexus-rendered-<name> in the
+        current directory, which restraint_xml then points at, so the
+        checked-in xml is left untouched.
         """
 
+        if not os.path.exists(self.restraint_xml):
+            logger.log.error("%s not found" % self.restraint_xml)
+            sys.exit(2)
+
         logger.log.info("Updating %s with existing_node information" % \
                         self.restraint_xml)
-        node = 0
-        host_num = 1
-        host_recipe = []
-        while node < len(self.existing_nodes):
-            if os.path.exists(self.restraint_xml):
-                host_num = str(host_num)
-                hostname = ("hostname" + host_num);
-                host_num = int(host_num)
-                j = open(self.restraint_xml, 'r').read()
-                m = j.replace(hostname, (self.existing_nodes[node]))
-                f = open(self.restraint_xml, 'w')
-                f.write(m)
-                f.close()
-
-                mystr = "-t" + " " + str(host_num) + '=' + self.existing_nodes[node]
-
-                host_recipe.append(mystr)
-                self.restraint_hosts = " ".join(host_recipe)
-                node = node + 1
-                host_num = host_num + 1
-            else:
-                logger.log.error("%s not found" % self.restraint_xml)
-                sys.exit(2)
+        self.restraint_hosts = " ".join("-t %d=%s" % (num, host) for num, host
+                                        in enumerate(self.existing_nodes, 1))
+
+        def hostname(match):
+            num = int(match.group(1))
+            if 1 <= num <= len(self.existing_nodes):
+                return self.existing_nodes[num - 1]
+            return match.group(0)
 
+        replacements = []
         if self.git_test_branch == "default":
             logger.log.info("Using the default branch to run tests.")
         else:
             self.git_test_branch_url = self.git_repo_url + "?" + self.git_test_branch
             self.git_test_branch_task = "/" + self.git_test_branch + "/"
-
-            j = open(self.restraint_xml, 'r').read()
-            m = j.replace(self.git_repo_url, self.git_test_branch_url)
-            f = open(self.restraint_xml, 'w')
-            f.write(m)
-            f.close()
-
-            j = open(self.restraint_xml, 'r').read()
-            n = j.replace("/master/", self.git_test_branch_task)
-            f = open(self.restraint_xml, 'w')
-            f.write(n)
-            f.close()
+            replacements.append((self.git_repo_url, self.git_test_branch_url))
+            replacements.append(("/master/", self.git_test_branch_task))
             logger.log.info("Updating restraint xml to use %s branch" % self.git_test_branch)
 
         logger.log.info("Updating restraint xml to use %s as task name" % self.job_name)
-        j = open(self.restraint_xml, 'r').read()
-        m = j.replace("JENKINS_JOB_NAME", self.job_name)
-        f = open(self.restraint_xml, 'w')
-        f.write(m)
-        f.close()
+        replacements.append(("JENKINS_JOB_NAME", self.job_name))
+
+        def render(value):
+            value = HOSTNAME_TOKEN.sub(hostname, value)
+            for old, new in replacements:
+                value = value.replace(old, new)
+            return value
+
+        # parsed with the comments and the text around the root element kept
+        # aside, so the rendered job only differs by the replacements made
+        with open(self.restraint_xml) as xml:
+            content = xml.read()
+        parser = ET.XMLParser(target=CommentedTreeBuilder())
+        parser.feed(content)
+        tree = ET.ElementTree(parser.close())
+        prolog = PROLOG.match(content).group(0)
+        epilogue = xml_epilogue(content)
+        for element in tree.iter():
+            for name, value in element.attrib.items():
+                element.set(name, render(value))
+            if element.text:
+                element.text = render(element.text)
+            if element.tail:
+                element.tail = render(element.tail)
 
         if self.git_refspec:
             logger.log.info("GERRIT_REFSPEC found in evnironment variable")
-            tree = ET.parse(self.restraint_xml)
-            root = tree.getroot()
-            p = root.find("recipeSet")
-            fetches = p.getiterator("fetch")
-            for i in fetches:
-                git_repo_url = i.attrib['url'].split('#')[0]
-                task_name = i.attrib['url'].split('#')[1]
-                i.attrib["url"] = git_repo_url + "?" + self.git_refspec + "#" + task_name
-
-            tree.write(self.restraint_xml)
+            for fetch in tree.iter("fetch"):
+                git_repo_url, sep, task_name = fetch.attrib['url'].partition('#')
+                fetch.attrib["url"] = git_repo_url + "?" + self.git_refspec + sep + task_name
             logger.log.info("Updated %s to fetch GERRIT_REFSPEC" % self.restraint_xml)
 
+        rendered = RENDERED_PREFIX + os.path.basename(self.restraint_xml)
+        with open(rendered, 'w') as out:
+            out.write(render(prolog))
+            tree.write(out)
+            out.write(render(epilogue))
+        logger.log.info("Wrote the updated %s to %s" % (self.restraint_xml, rendered))
+        self.restraint_xml = rendered
+
     def execute_restraint(self):
         """
         Check for the length of resources and build appropriate restraint
@@ -210,7 +247,6 @@ class Restraint():
 
         if not self.git_refspec:
             logger.log.info("Converting job.xml to junit")
-            job2junit = "/usr/share/restraint/client/job2junit.xml"
 
             all_dirs = [d for d in os.listdir('.') if os.path.isdir(d)]
             latest_dir = max(all_dirs, key=os.path.getmtime)
@@ -218,16 +254,7 @@ class Restraint():
             job_xml = os.path.join(latest_dir, "job.xml")
 
             if os.path.exists(job_xml):
-                args = ('xsltproc', '/usr/share/restraint/client/job2junit.xml', job_xml)
-                p_out = subprocess.PIPE
-                p_err = subprocess.PIPE
-
-                p = subprocess.Popen(args,stdout=p_out,stderr=p_err)
-                stdout,stderr = p.communicate()
-
-                fd = open("junit.xml", "w")
-                fd.write(stdout)
-                fd.close()
+                job_to_junit(job_xml, "junit.xml")
             else:
                 logger.log.warn("job.xml not found.")
         else:
@@ -257,7 +284,7 @@ class Restraint():
         """
 
         logger.log.info("Running restraint...")
-        threads = Threader()
+        facts.gather(self.existing_nodes, self.username, self.password, conf_dict)
 
         self.job_name = conf_dict['jenkins']['job_name']
         self.git_repo_url = conf_dict['git']['git_repo_url']
@@ -275,15 +302,10 @@ class Restraint():
                 self.restraint_job_xml_loc = conf_dict['restraint']['job_xml_loc']
                 self.restraint_xml = os.path.join(self.restraint_job_xml_loc, self.what_test)
 
-            threads.gather_results([threads.get_item(self.restraint_setup, \
-                                    host, conf_dict) for host in \
-                                    self.existing_nodes])
+            self.nodes.map(self.restraint_setup, conf_dict)
         else:
             self.restraint_xml = options.restraint_xml
-            threads = Threader()
-            threads.gather_results([threads.get_item(self.restraint_setup, \
-                                    host, conf_dict) for host in \
-                                    self.existing_nodes])
+            self.nodes.map(self.restraint_setup, conf_dict)
 
         logger.log.info("Using %s" % self.restraint_xml)
 
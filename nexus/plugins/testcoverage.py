@@ -15,7 +15,7 @@ import sys
 import platform
 from subprocess import Popen, PIPE, STDOUT
 from scp import SCPClient
-from nexus.lib.factory import SSHClient
+from nexus.lib.factory import ssh_pool
 from nexus.lib.factory import Threader
 from nexus.lib import logger
 from nexus.lib.ci_message import CI_MSG
@@ -54,61 +54,45 @@ class Testcoverage():
         f.close()
 
         master = self.existing_nodes[0]
-        ssh_c = SSHClient(hostname = master, username = \
-                        self.username, password = self.password)
+        ssh_c = ssh_pool.get(master, self.username, self.password)
 
     def copy_site_custom(self, options, conf_dict):
 
         master = self.existing_nodes[0]
-        ssh_c = SSHClient(hostname = master, username = \
-                        self.username, password = self.password)
+        ssh_c = ssh_pool.get(master, self.username, self.password)
 
-        source = self.site_customize
-        destination = os.path.join(self.site_packages, 'sitecustomize.py')
-        logger.log.info("source file is %s" % source)
-        ssh_c.CopyFiles(source, destination)
-
-        source = self.coverage_conf
-        destination = self.coverage_rc
-        logger.log.info("source file is %s" % source)
-        ssh_c.CopyFiles(source, destination)
+        site_customize_dest = os.path.join(self.site_packages, 'sitecustomize.py')
+        ssh_c.CopyFilesBulk([(self.site_customize, site_customize_dest),
+                             (self.coverage_conf, self.coverage_rc)])
 
     def coverage_reports(self, options, conf_dict):
 
         master = self.existing_nodes[0]
-        ssh_c = SSHClient(hostname = master, username = \
-                        self.username, password = self.password)
+        ssh_c = ssh_pool.get(master, self.username, self.password)
 
         coverage_combine = "coverage combine --rcfile=" + self.coverage_rc
-        stdout,stderr,exit_status = ssh_c.ExecuteScript(coverage_combine)
-        output = stdout.getvalue()
-        error = stderr.getvalue()
+        result = ssh_c.ExecuteLogged(coverage_combine)
 
-        if error:
-            print "error running script: ", error
-            print "Exit status: ", exit_status
-        else:
-            print "Script output: ", output
+        if result.exit_status != 0:
+            logger.log.error("%s exited with %s on %s" % \
+                             (coverage_combine, result.exit_status, master))
+            for line in result.stderr_tail: logger.log.error(line)
 
         coverage_cmd = "coverage report --rcfile=" + self.coverage_rc + ";" \
                         "coverage xml --rcfile=" + self.coverage_rc + ";" \
                         "coverage html --rcfile=" + self.coverage_rc
-        stdout,stderr,exit_status = ssh_c.ExecuteScript(coverage_cmd)
-        output = stdout.getvalue()
-        error = stderr.getvalue()
+        result = ssh_c.ExecuteLogged(coverage_cmd)
 
-        if error:
-            print "error running script: ", error
-            print "Exit status: ", exit_status
-        else:
-            print "Script output: ", output
+        if result.exit_status != 0:
+            logger.log.error("%s exited with %s on %s" % \
+                             (coverage_cmd, result.exit_status, master))
+            for line in result.stderr_tail: logger.log.error(line)
 
 
     def get_reports(self, options, conf_dict):
 
         master = self.existing_nodes[0]
-        ssh_c = SSHClient(hostname = master, username = \
-                        self.username, password = self.password)
+        ssh_c = ssh_pool.get(master, self.username, self.password)
 
         coverage_xml = conf_dict['coverage']['coverage_xml']
         scp = SCPClient(ssh_c.get_transport())
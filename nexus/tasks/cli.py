@@ -12,19 +12,44 @@
 
 import os
 import sys
-import yum
 import argparse
+import importlib
 import ConfigParser
 from nexus.lib import logger
-from nexus.lib import factory
-from nexus.plugins.brew import Brew
-from nexus.plugins.restraint import Restraint
-from nexus.plugins.errata import Errata
-from nexus.plugins.git import Git
-from nexus.plugins.ci import CI
-from nexus.plugins.my_jenkins import Jenkins
+from nexus.lib.conf import Conf_ini
 from nexus.lib.ci_message import CI_MSG
-import nexus.version
+
+# Module and class implementing each command. A plugin is only imported when
+# its command runs, so a command does not pay for the imports (koji,
+# paramiko, jenkins, ...) of the others.
+PLUGINS = {
+    'git': ('nexus.plugins.git', 'Git'),
+    'brew': ('nexus.plugins.brew', 'Brew'),
+    'errata': ('nexus.plugins.errata', 'Errata'),
+    'restraint': ('nexus.plugins.restraint', 'Restraint'),
+    'jenkins': ('nexus.plugins.my_jenkins', 'Jenkins'),
+    'ci': ('nexus.plugins.ci', 'CI'),
+}
+
+def load_plugin(command):
+    """ Import and return the plugin class of command. """
+    module, name = PLUGINS[command]
+    return getattr(importlib.import_module(module), name)
+
+def rpm_installed(name):
+    """ True if the rpm name is installed. yum is slow to import, only the
+    commands that check for an rpm load it. """
+    import yum
+    return bool(yum.YumBase().rpmdb.searchNevra(name=name))
+
+class VersionAction(argparse.Action):
+    """ --version, looking the version up only when it is asked for. """
+
+    def __init__(self, option_strings, dest, help=None):
+        argparse.Action.__init__(self, option_strings, dest, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        parser.exit(message=version() + "\n")
 
 def create_parser():
     parser = argparse.ArgumentParser()
@@ -47,10 +72,14 @@ def create_parser():
                             not provided')
     parser_brew.add_argument('--loc', help='Absolute path of download to \
                             directory')
+    parser_brew.add_argument('--sync', action='store_true', help='Only download \
+                            builds that changed since the last sync and prune \
+                            the ones no longer tagged')
     parser_brew.add_argument('--show-triggers', help=argparse.SUPPRESS)
 
     parser_errata = subparser.add_parser('errata')
-    parser_errata.add_argument('--errata-id', help='Errata Id')
+    parser_errata.add_argument('--errata-id', help='Errata Id, or a comma \
+                                separated list of them')
     parser_errata.add_argument('--errata-loc', help='Absolute path of download \
                                 to directory')
     parser_errata.add_argument('--show-triggers', help=argparse.SUPPRESS)
@@ -75,6 +104,12 @@ def create_parser():
                             provisioning')
     parser_ci.add_argument('--framework', help='Test automation framework')
     parser_ci.add_argument('--coverage', action='store_true', help='Test automation coverage')
+    parser_ci.add_argument('--serve-builds', action='store_true', help='Serve \
+                            the builds downloaded by nexus brew to the test \
+                            resources as a yum repository')
+    parser_ci.add_argument('--push-builds', action='store_true', help='Copy \
+                            the builds downloaded by nexus brew to every test \
+                            resource and install them there')
     parser_ci.add_argument('--project', help=argparse.SUPPRESS)
     parser_ci.add_argument('--repo', help=argparse.SUPPRESS)
     parser_ci.add_argument('--branch', help=argparse.SUPPRESS)
@@ -86,8 +121,7 @@ def create_parser():
 
 
     parser.add_argument('--conf', dest='conf', help='configuration file')
-    parser.add_argument('--version', dest='version', action='version', \
-                        version=version(),
+    parser.add_argument('--version', dest='version', action=VersionAction,
                         help='show version')
 
     return parser
@@ -162,7 +196,7 @@ def setup_conf(options):
         config.write(confini)
 
     if os.path.isfile(conf):
-        f = factory.Conf_ini()
+        f = Conf_ini()
         f.read(conf)
         logger.log.info("Writing environment details to %s" % conf)
         conf_dict = f.conf_to_dict()
@@ -170,20 +204,18 @@ def setup_conf(options):
 
 def execute(options, conf_dict):
 
-    yb = yum.YumBase()
-
     if options.command == 'git':
-        if yb.rpmdb.searchNevra(name='git'):
+        if rpm_installed('git'):
             logger.log.info("Git rpm found.")
 
-            git = Git(options, conf_dict)
+            git = load_plugin('git')(options, conf_dict)
             git.get_archive()
         else:
             logger.log.error("Git rpm not installed.")
             sys.exit(2)
 
     elif options.command == 'beaker':
-        if yb.rpmdb.searchNevra(name='beaker-client'):
+        if rpm_installed('beaker-client'):
             logger.log.info("beaker-client rpm found")
 
             beaker = Beaker(options, conf_dict)
@@ -193,19 +225,22 @@ def execute(options, conf_dict):
             sys.exit(2)
 
     elif options.command == 'brew':
-        if yb.rpmdb.searchNevra(name='koji'):
+        if rpm_installed('koji'):
             logger.log.info("Koji rpm found.")
 
-            brew = Brew(options, conf_dict)
-            brew.get_latest(options, conf_dict)
+            brew = load_plugin('brew')(options, conf_dict)
+            if options.sync:
+                brew.sync(conf_dict)
+            else:
+                brew.get_latest(options, conf_dict)
         else:
             logger.log.error("Koji rpm not installed.")
             sys.exit(2)
 
     elif options.command == 'restraint':
-        if yb.rpmdb.searchNevra(name='restraint-client'):
+        if rpm_installed('restraint-client'):
             logger.log.info("restraint-client rpm found.")
-            restraint = Restraint(options, conf_dict)
+            restraint = load_plugin('restraint')(options, conf_dict)
             restraint.run_restraint(options, conf_dict)
             restraint.restraint_junit()
         else:
@@ -213,16 +248,17 @@ def execute(options, conf_dict):
             sys.exit(2)
 
     elif options.command == 'errata':
-        errata = Errata(options, conf_dict)
-        errata.download_errata_builds()
+        errata = load_plugin('errata')(options, conf_dict)
+        errata.download_errata_builds(conf_dict)
     elif options.command == 'jenkins':
-        jenkins = Jenkins(options, conf_dict)
+        jenkins = load_plugin('jenkins')(options, conf_dict)
         jenkins.main(options, conf_dict)
     elif options.command == 'ci':
-        ci = CI(options, conf_dict)
+        ci = load_plugin('ci')(options, conf_dict)
         ci.run(options, conf_dict)
 
 def version():
+    import nexus.version
     return "version: %s" % nexus.version.version_info.version_string()
 
 if __name__ == '__main__':
@@ -20,6 +20,8 @@ import paramiko
 import argparse
 import StringIO
 import socket
+import time
+from nexus.lib.factory import backoff_delay
 
 class SSHClient(paramiko.SSHClient):
     """ This class Inherits paramiko.SSHClient and implements client.exec_commands 
@@ -124,6 +126,7 @@ def main():
         except socket.error, e:
 	    print "There was some error connecting host:", e
             print "Try again: ", count
+	    time.sleep(backoff_delay(count - 1, base=1.0, cap=30.0))
 	    count += 1
 	except paramiko.AuthenticationException, e:
 	    print "Wrong username and password"
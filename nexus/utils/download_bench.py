@@ -0,0 +1,426 @@
+#!/usr/bin/python
+# Copyright (c) 2015 Red Hat, Inc. All rights reserved.
+#
+# This copyrighted material is made available to anyone wishing
+# to use, modify, copy, or redistribute it subject to the terms
+# and conditions of the GNU General Public License version 2.
+#
+# You should have received a copy of the GNU General Public
+# License along with this program; if not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+
+"""
+This tool measures how fast nexus brew and nexus errata download builds,
+without touching the production hubs.
+
+It starts a fake hub, an XML-RPC server answering the koji and errata tool
+calls nexus makes, and a fake brewroot, an HTTP server serving synthetic
+rpms with the latency and bandwidth asked for. Brew.get_latest and
+Errata.download_errata_builds are then run against them for every rpm count
+given, each run in a process of its own, and the wall time, throughput, hub
+round trips and calls, and peak RSS of every run are reported.
+
+    ~$ python -m nexus.utils.download_bench --rpms 10,100,1000,5000
+        --latency 0.02 --bandwidth 20M
+"""
+
+import os
+import json
+import time
+import shutil
+import struct
+import hashlib
+import logging
+import argparse
+import resource
+import tempfile
+import threading
+import multiprocessing
+import SocketServer
+import BaseHTTPServer
+import SimpleXMLRPCServer
+import xmlrpclib
+from nexus.lib import logger
+from nexus.lib.rpmcache import parse_size
+from nexus.lib.factory import DEFAULT_MAX_WORKERS
+
+CHUNK_SIZE = 65536
+ARCH = 'x86_64'
+MOUNT_BASE = '/mnt/redhat/nexus-bench'
+
+# 64K of noise the payload of every synthetic rpm is cut from
+BLOCK = hashlib.sha512('nexus-bench').digest() * (CHUNK_SIZE // 64)
+
+def rpm_lead(seed):
+    """ Lead and an empty signature header of a synthetic rpm: enough for
+    nexus.lib.downloader.sigmd5 to find the payload. """
+    lead = '\xed\xab\xee\xdb' + struct.pack('>I', seed)
+    return lead.ljust(96, '\0') + '\x8e\xad\xe8\x01' + '\0' * 12
+
+def rpm_chunks(seed, size):
+    """ Content of the synthetic rpm seed, size bytes long, in chunks. """
+    data = rpm_lead(seed) + struct.pack('>I', seed) * 16
+    left = size
+    while left > 0:
+        if len(data) < CHUNK_SIZE:
+            data += BLOCK[:CHUNK_SIZE - len(data)]
+        chunk, data = data[:left], ''
+        left -= len(chunk)
+        yield chunk
+
+def payloadhash(seed, size):
+    md5 = hashlib.md5()
+    skip = len(rpm_lead(seed))
+    for chunk in rpm_chunks(seed, size):
+        md5.update(chunk[skip:])
+        skip = max(0, skip - len(chunk))
+    return md5.hexdigest()
+
+class FakeHub(object):
+    """
+    Builds of packages named bench0, bench1, ... each with rpms_per_build
+    rpms. The tag bench-<n> holds the builds of the first n rpms and
+    erratum <n> has them attached. Rpm sizes cycle between 40% and 160% of
+    size so the downloads are not all alike.
+    """
+
+    def __init__(self, max_rpms, rpms_per_build, size):
+        self.rpms_per_build = rpms_per_build
+        self.builds = []
+        self.rpms = {}
+        self.nvras = {}
+        self.files = {}
+        for i in range(max_rpms):
+            build_id = i // rpms_per_build + 1
+            if build_id > len(self.builds):
+                name = "bench%d" % build_id
+                self.builds.append({'id': build_id, 'build_id': build_id,
+                                    'name': name, 'package_name': name,
+                                    'version': '1.0', 'release': '1',
+                                    'epoch': None, 'volume_name': 'DEFAULT',
+                                    'nvr': "%s-1.0-1" % name})
+                self.rpms[build_id] = []
+            rpm_size = int(size * (1 + i % 4) / 2.5)
+            rpm = {'id': i + 1, 'build_id': build_id, 'arch': ARCH,
+                   'name': "bench%d-sub%d" % (build_id, i % rpms_per_build),
+                   'version': '1.0', 'release': '1', 'epoch': None,
+                   'size': rpm_size, 'payloadhash': payloadhash(i + 1, rpm_size)}
+            self.rpms[build_id].append(rpm)
+            self.nvras["%(name)s-%(version)s-%(release)s.%(arch)s" % rpm] = rpm
+            self.files[self.rpm_path(rpm)] = (i + 1, rpm_size)
+
+    def rpm_path(self, rpm):
+        build = self.builds[rpm['build_id'] - 1]
+        return "/brewroot/packages/%s/%s/%s/%s/%s-%s-%s.%s.rpm" % \
+               (build['name'], build['version'], build['release'], rpm['arch'],
+                rpm['name'], rpm['version'], rpm['release'], rpm['arch'])
+
+    def tagged_builds(self, tag):
+        count = int(tag.rpartition('-')[2])
+        return self.builds[:-(-count // self.rpms_per_build)]
+
+    def listTagged(self, tag, event=None, inherit=False, prefix=None,
+                   latest=False, package=None, owner=None, type=None):
+        builds = self.tagged_builds(tag)
+        if package is not None:
+            builds = [b for b in builds if b['name'] == package]
+        return builds
+
+    def listRPMs(self, buildID=None, buildrootID=None, imageID=None,
+                 componentBuildrootID=None, hostID=None, arches=None,
+                 queryOpts=None):
+        rpms = self.rpms.get(buildID, [])
+        if arches:
+            if isinstance(arches, basestring):
+                arches = [arches]
+            rpms = [r for r in rpms if r['arch'] in arches]
+        return rpms
+
+    def getRPM(self, rpminfo, strict=False, multi=False):
+        return self.nvras.get(rpminfo)
+
+    def getErrataPackages(self, errata_id):
+        return [MOUNT_BASE + self.rpm_path(rpm)
+                for build in self.tagged_builds("bench-%s" % errata_id)
+                for rpm in self.rpms[build['id']]]
+
+    def getLastEvent(self):
+        return {'id': 1, 'ts': 0}
+
+    def tagChangedSinceEvent(self, event, taglist):
+        return False
+
+    def getTag(self, tag):
+        return {'id': 1, 'name': tag}
+
+    def getFullInheritance(self, tag):
+        return []
+
+class _HubServer(SocketServer.ThreadingMixIn, SimpleXMLRPCServer.SimpleXMLRPCServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _HubHandler(SimpleXMLRPCServer.SimpleXMLRPCRequestHandler):
+    # koji posts to the path of the hub URL, answer on any path
+    rpc_paths = ()
+
+    def log_message(self, format, *args):
+        pass
+
+class HubDispatcher(object):
+    """ Dispatches XML-RPC calls to a FakeHub the way the koji hub does,
+    keyword arguments and multiCall included. Every request counts as a
+    round trip and every call in it, multicalled ones included, as a call. """
+
+    def __init__(self, hub, round_trips, calls, latency):
+        self.hub = hub
+        self.round_trips = round_trips
+        self.calls = calls
+        self.latency = latency
+
+    def call(self, method, params):
+        with self.calls.get_lock():
+            self.calls.value += 1
+        params = list(params)
+        kwargs = {}
+        if params and isinstance(params[-1], dict) and params[-1].get('__starstar'):
+            kwargs = params.pop()
+            del kwargs['__starstar']
+        if method.startswith('_') or not hasattr(self.hub, method):
+            raise xmlrpclib.Fault(1000, "Invalid method: %s" % method)
+        return getattr(self.hub, method)(*params, **kwargs)
+
+    def _dispatch(self, method, params):
+        with self.round_trips.get_lock():
+            self.round_trips.value += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if method != 'multiCall':
+            return self.call(method, params)
+        results = []
+        for call in params[0]:
+            try:
+                results.append([self.call(call['methodName'], call['params'])])
+            except Exception as e:
+                results.append({'faultCode': getattr(e, 'faultCode', 1000),
+                                'faultString': str(e)})
+        return results
+
+class _FileHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Serves the rpms of the hub of the server, each response after
+    latency seconds and at most bandwidth bytes per second. """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        path = self.path.split('?')[0]
+        if path not in server.hub.files:
+            self.send_error(404)
+            return
+        seed, size = server.hub.files[path]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-rpm')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        start = time.time()
+        sent = 0
+        for chunk in rpm_chunks(seed, size):
+            self.wfile.write(chunk)
+            sent += len(chunk)
+            if server.bandwidth:
+                delay = start + float(sent) / server.bandwidth - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+    def log_message(self, format, *args):
+        pass
+
+class _FileServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def serve(hub, latency, rpc_latency, bandwidth, round_trips, calls, ports):
+    """ Run the fake hub and brewroot until killed, sending their ports
+    back through the ports queue. """
+    rpc = _HubServer(('127.0.0.1', 0), _HubHandler, logRequests=False,
+                     allow_none=True)
+    rpc.register_instance(HubDispatcher(hub, round_trips, calls, rpc_latency))
+    http = _FileServer(('127.0.0.1', 0), _FileHandler)
+    http.hub = hub
+    http.latency = latency
+    http.bandwidth = bandwidth
+    thread = threading.Thread(target=http.serve_forever)
+    thread.daemon = True
+    thread.start()
+    ports.put((rpc.server_address[1], http.server_address[1]))
+    rpc.serve_forever()
+
+class Options(object):
+    """ Stand-in for the parsed nexus command line. """
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+def conf_for(hub_url, root_url, count, location, workers, rpm_cache_dir):
+    conf_dict = {
+        'brew': {'brew_hub': hub_url, 'brew_root': root_url + '/brewroot',
+                 'brew_tag': "bench-%d" % count, 'brew_arch': ARCH,
+                 'build_download_loc': location},
+        'errata': {'xmlrpc_url': hub_url, 'download_devel': root_url,
+                   'mount_base': MOUNT_BASE, 'build_download_loc': location},
+        'concurrency': {'brew': workers, 'errata': workers},
+    }
+    if rpm_cache_dir:
+        conf_dict['cache'] = {'cache_dir': rpm_cache_dir}
+    return conf_dict
+
+def run_brew(conf_dict, count):
+    from nexus.plugins.brew import Brew
+    options = Options(tag=None, arch=None, loc=None, build=None)
+    Brew(options, conf_dict).get_latest(options, conf_dict)
+
+def run_errata(conf_dict, count):
+    from nexus.plugins.errata import Errata
+    options = Options(errata_id=str(count), errata_loc=None)
+    Errata(options, conf_dict).download_errata_builds(conf_dict)
+
+SCENARIOS = {'brew': run_brew, 'errata': run_errata}
+
+def directory_size(path):
+    files = 0
+    size = 0
+    for root, dirs, names in os.walk(path):
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(root, name))
+    return files, size
+
+def run_scenario(name, conf_dict, count, results):
+    """ Run scenario name in this process and put its results in the
+    results queue. """
+    try:
+        location = conf_dict['brew']['build_download_loc']
+        start = time.time()
+        SCENARIOS[name](conf_dict, count)
+        seconds = time.time() - start
+        files, size = directory_size(location)
+        results.put({'seconds': seconds, 'files': files, 'bytes': size,
+                     'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024})
+    except Exception as e:
+        results.put({'error': "%s: %s" % (e.__class__.__name__, e)})
+
+def bench(name, count, hub_url, root_url, round_trips, calls, workers,
+          rpm_cache_dir=None):
+    """ Result of one run of scenario name over count rpms, measured in a
+    process of its own so its peak RSS is not that of earlier runs. """
+    location = tempfile.mkdtemp(prefix="nexus-bench-")
+    conf_dict = conf_for(hub_url, root_url, count, location, workers, rpm_cache_dir)
+    results = multiprocessing.Queue()
+    round_trips.value = calls.value = 0
+    process = multiprocessing.Process(target=run_scenario,
+                                      args=(name, conf_dict, count, results))
+    process.start()
+    try:
+        result = results.get()
+    finally:
+        process.join()
+        shutil.rmtree(location, ignore_errors=True)
+    result.update({'scenario': name, 'rpms': count, 'workers': workers,
+                   'round_trips': round_trips.value, 'calls': calls.value})
+    if 'error' not in result:
+        result['bytes_per_second'] = result['bytes'] / result['seconds'] \
+                                     if result['seconds'] > 0 else 0
+    return result
+
+HEADER = "%-8s %6s %6s %10s %9s %8s %6s %6s %8s" % \
+         ('scenario', 'rpms', 'files', 'MB', 'seconds', 'MB/s', 'trips',
+          'calls', 'rss MB')
+
+def format_result(result):
+    if 'error' in result:
+        return "%-8s %6d failed: %s" % (result['scenario'], result['rpms'],
+                                        result['error'])
+    return "%-8s %6d %6d %10.1f %9.2f %8.2f %6d %6d %8.1f" % \
+           (result['scenario'], result['rpms'], result['files'],
+            result['bytes'] / 1048576.0, result['seconds'],
+            result['bytes_per_second'] / 1048576.0, result['round_trips'],
+            result['calls'], result['peak_rss'] / 1048576.0)
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Measures nexus brew and \
+                                     nexus errata downloads against a local \
+                                     fake hub and brewroot.')
+    parser.add_argument('--rpms', default='10,100,1000',
+                        help='Comma separated rpm counts to run at. Defaults \
+                        to 10,100,1000')
+    parser.add_argument('--scenarios', default='brew,errata',
+                        help='Comma separated scenarios, brew and errata')
+    parser.add_argument('--size', default='256K', help='Average rpm size, \
+                        K, M and G suffixes allowed. Defaults to 256K')
+    parser.add_argument('--rpms-per-build', type=int, default=10,
+                        help='Rpms in every build')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds before every file download starts')
+    parser.add_argument('--rpc-latency', type=float, default=0.0,
+                        help='Seconds every hub round trip takes')
+    parser.add_argument('--bandwidth', default=None, help='Bytes per second \
+                        of every file download, K, M and G suffixes allowed. \
+                        Unlimited by default')
+    parser.add_argument('--workers', type=int, default=DEFAULT_MAX_WORKERS,
+                        help='Number of parallel downloads')
+    parser.add_argument('--rpm-cache-dir', help='Run with the rpm cache in \
+                        this directory')
+    parser.add_argument('--json', help='Write the results to this file as \
+                        json as well')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Keep the nexus log')
+    return parser
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    counts = [int(c) for c in args.rpms.split(',')]
+    scenarios = [s.strip() for s in args.scenarios.split(',')]
+    for name in scenarios:
+        if name not in SCENARIOS:
+            raise SystemExit("Unknown scenario %s" % name)
+    if not args.verbose:
+        logger.log.setLevel(logging.WARNING)
+
+    hub = FakeHub(max(counts), args.rpms_per_build, parse_size(args.size))
+    round_trips = multiprocessing.Value('i', 0)
+    calls = multiprocessing.Value('i', 0)
+    ports = multiprocessing.Queue()
+    bandwidth = parse_size(args.bandwidth) if args.bandwidth else None
+    server = multiprocessing.Process(target=serve,
+                                     args=(hub, args.latency, args.rpc_latency,
+                                           bandwidth, round_trips, calls, ports))
+    server.daemon = True
+    server.start()
+    rpc_port, http_port = ports.get()
+    hub_url = "http://127.0.0.1:%d/hub" % rpc_port
+    root_url = "http://127.0.0.1:%d" % http_port
+
+    results = []
+    print(HEADER)
+    try:
+        for count in counts:
+            for name in scenarios:
+                result = bench(name, count, hub_url, root_url, round_trips,
+                               calls, args.workers, args.rpm_cache_dir)
+                print(format_result(result))
+                results.append(result)
+    finally:
+        server.terminate()
+        server.join()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+if __name__ == '__main__':
+    main()
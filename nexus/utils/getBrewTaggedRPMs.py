@@ -18,63 +18,81 @@
 """
 This tool downloads the latest build from brew based on the tag, rpm name
 and download to location provided as arguments.
+
+It can also be imported: download_tagged() does the same for any koji hub
+and returns the downloads.
 """
 
-import koji as brew
-import os.path
-import urllib2
+import os
 import argparse
-import json
-
-pathinfo = brew.PathInfo(topdir='http://download.lab.bos.redhat.com/brewroot')
-brew = brew.ClientSession('http://brewhub.devel.redhat.com/brewhub')
+from nexus.lib.factory import DEFAULT_MAX_WORKERS
+from nexus.lib.rpmcache import RPMCache
+from nexus.lib.kojicache import KojiCache
+from nexus.lib.kojicache import latest_rpms
+from nexus.lib.downloader import Downloader
+from nexus.lib.downloader import rpm_download
 
-parser = argparse.ArgumentParser(description='This tool downloads the latest \
-                                builds from brew based on its tag, rpm name \
-                                and download to location provided as part of \
-                                its arguments.')
-# Parse options
-required = parser.add_argument_group('required arguments')
-required.add_argument('--brew-tag', help='brew tag', required=True)
-required.add_argument('--pkg', help='pkg name', required=True)
-parser.add_argument('--arch', help='Machine arch. Defaults to all it not \
-                    provided')
-required.add_argument('--location', help='Absolute path of download \
-                        to directory', required=True)
-args = parser.parse_args()
+BREW_HUB = 'http://brewhub.devel.redhat.com/brewhub'
+BREW_ROOT = 'http://download.lab.bos.redhat.com/brewroot'
 
-tag = args.brew_tag
-pkg = args.pkg
-arch = args.arch
+def download_tagged(tag, pkg, location, arch=None, hub=BREW_HUB, root=BREW_ROOT,
+                    cache_dir=None, rpm_cache_dir=None,
+                    max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Downloads the rpms of the latest build of pkg tagged with tag on hub
+    into location, from the package tree at root. arch limits the rpms to
+    one arch, all are downloaded if it is None. cache_dir keeps hub answers
+    and rpm_cache_dir rpms between runs. Files are streamed to disk on at
+    most max_workers connections. Returns the Downloads.
+    """
+    import koji
+    session = koji.ClientSession(hub)
+    pathinfo = koji.PathInfo(topdir=root)
 
-download_dir = args.location
-if not os.path.exists(download_dir):
-    os.makedirs(download_dir)
+    if not os.path.exists(location):
+        os.makedirs(location)
 
-# Lists the latest build for the brew tag and package name provided as
-# arguments
-builds = brew.listTagged(tag, latest=True, package=pkg, type=None,
-inherit=True)
+    rpms = latest_rpms(KojiCache(session, cache_dir), pathinfo, tag, [pkg], arch)
+    rpm_cache = RPMCache(rpm_cache_dir) if rpm_cache_dir else None
+    downloads = [rpm_download(rpm, location) for rpm in rpms]
+    return Downloader(max_workers, cache=rpm_cache).fetch_all(downloads)
 
-for build in builds:
-    buildpath = pathinfo.build(build)
+def add_common_arguments(parser, required):
+    """ Options shared with getKojiTaggedRPMs. """
+    required.add_argument('--pkg', help='pkg name', required=True)
+    parser.add_argument('--arch', help='Machine arch. Defaults to all it not \
+                        provided')
+    required.add_argument('--location', help='Absolute path of download \
+                            to directory', required=True)
+    parser.add_argument('--cache-dir', help='Directory to cache hub answers in \
+                        between runs')
+    parser.add_argument('--rpm-cache-dir', help='Directory to cache rpms in \
+                        between runs')
+    parser.add_argument('--workers', type=int, default=DEFAULT_MAX_WORKERS,
+                        help='Number of parallel downloads')
 
-    # Lists latest RPMs
-    rpms = brew.listRPMs(build['id'], arches=arch)
+def create_parser():
+    parser = argparse.ArgumentParser(description='This tool downloads the latest \
+                                    builds from brew based on its tag, rpm name \
+                                    and download to location provided as part of \
+                                    its arguments.')
+    required = parser.add_argument_group('required arguments')
+    required.add_argument('--brew-tag', help='brew tag', required=True)
+    add_common_arguments(parser, required)
+    return parser
 
-    for rpm in rpms:
-        rpmpath = pathinfo.rpm(rpm)
-        rpmurl = os.path.join(buildpath, rpmpath)
-        rpmname = os.path.join(download_dir,rpmurl.split('/')[-1])
+def print_downloads(downloads):
+    for download in downloads:
+        print("Downloading: {0} Bytes: {1}".format(download.url,
+                                                   os.path.getsize(download.dest)))
+        print(download.dest)
 
-        # Download latest RPMs
-        u = urllib2.urlopen(rpmurl)
-        f = open(rpmname, 'wb')
-        f.write(u.read())
-        f.close()
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    print_downloads(download_tagged(args.brew_tag, args.pkg, args.location,
+                                    args.arch, cache_dir=args.cache_dir,
+                                    rpm_cache_dir=args.rpm_cache_dir,
+                                    max_workers=args.workers))
 
-        # Print information
-        meta = u.info()
-        file_size = int(meta.getheaders("Content-Length")[0])
-        print("Downloading: {0} Bytes: {1}".format(rpmurl, file_size))
-        print(rpmname)
+if __name__ == '__main__':
+    main()
@@ -8,65 +8,34 @@
 
 """
 This tool downloads the latest build from koji based on the tag, rpm name
-and download to location provided as arguments.
+and download to location provided as arguments. It is getBrewTaggedRPMs
+pointed at the Fedora koji.
 """
 
-import koji
-import os.path
-import urllib2
 import argparse
-import json
-
-pathinfo = koji.PathInfo(topdir='https://kojipkgs.fedoraproject.org')
-koji = koji.ClientSession('http://koji.fedoraproject.org/kojihub')
-
-parser = argparse.ArgumentParser(description='This tool downloads the latest \
-                                builds from koji based on its tag, rpm name \
-                                and download to location provided as part of \
-                                its arguments.')
-# Parse options
-required = parser.add_argument_group('required arguments')
-required.add_argument('--koji-tag', help='koji tag', required=True)
-required.add_argument('--pkg', help='pkg name', required=True)
-parser.add_argument('--arch', help='Machine arch. Defaults to all it not \
-                    provided')
-required.add_argument('--location', help='Absolute path of download \
-                        to directory', required=True)
-args = parser.parse_args()
-
-tag = args.koji_tag
-pkg = args.pkg
-arch = args.arch
-
-download_dir = args.location
-if not os.path.exists(download_dir):
-    os.makedirs(download_dir)
-
-# Lists the latest build for the koji tag and package name provided as
-# arguments
-builds = koji.listTagged(tag, latest=True, package=pkg, type=None,
-inherit=True)
-
-for build in builds:
-    buildpath = pathinfo.build(build)
-
-    # Lists latest RPMs
-    rpms = koji.listRPMs(build['id'], arches=arch)
-
-    for rpm in rpms:
-        rpmpath = pathinfo.rpm(rpm)
-        rpmurl = os.path.join(buildpath, rpmpath)
-        print rpmurl
-        rpmname = os.path.join(download_dir,rpmurl.split('/')[-1])
-
-        # Download latest RPMs
-        u = urllib2.urlopen(rpmurl)
-        f = open(rpmname, 'wb')
-        f.write(u.read())
-        f.close()
-
-        # Print information
-        meta = u.info()
-        file_size = int(meta.getheaders("Content-Length")[0])
-        print("Downloading: {0} Bytes: {1}".format(rpmurl, file_size))
-        print(rpmname)
+from nexus.utils.getBrewTaggedRPMs import download_tagged
+from nexus.utils.getBrewTaggedRPMs import add_common_arguments
+from nexus.utils.getBrewTaggedRPMs import print_downloads
+
+KOJI_HUB = 'http://koji.fedoraproject.org/kojihub'
+KOJI_ROOT = 'https://kojipkgs.fedoraproject.org'
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='This tool downloads the latest \
+                                    builds from koji based on its tag, rpm name \
+                                    and download to location provided as part of \
+                                    its arguments.')
+    required = parser.add_argument_group('required arguments')
+    required.add_argument('--koji-tag', help='koji tag', required=True)
+    add_common_arguments(parser, required)
+    return parser
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    print_downloads(download_tagged(args.koji_tag, args.pkg, args.location,
+                                    args.arch, KOJI_HUB, KOJI_ROOT,
+                                    args.cache_dir, args.rpm_cache_dir,
+                                    args.workers))
+
+if __name__ == '__main__':
+    main()
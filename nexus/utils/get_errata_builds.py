@@ -1,21 +1,28 @@
 #!/usr/bin/python
 
+""" Downloads the builds attached to an erratum. Can be run as a script or
+imported, Errata(...).dlPackages() returns the downloads. """
+
 import os
-import urllib2
+import argparse
 import ConfigParser
 import xmlrpclib
+from nexus.lib.factory import DEFAULT_MAX_WORKERS
+from nexus.lib.rpmcache import RPMCache
+from nexus.lib.downloader import Download
+from nexus.lib.downloader import Downloader
 
 class Errata():
     """This class is to get values from errata"""
 
-    def __init__(self):
-        """Initialize connection to xmlrpc server using xmlrpc_url. errata_id is required
-        for initialization, if not given then the script will exit.
+    def __init__(self, errata_id=None, workspace_loc=None):
+        """Initialize connection to xmlrpc server using xmlrpc_url. errata_id and
+        workspace_loc default to the errata_id and WORKSPACE environment
+        variables.
         """
-        errata_id = os.environ.get("errata_id")
-        self.errata_id = errata_id
+        self.errata_id = errata_id or os.environ.get("errata_id")
 
-        workspace_loc = os.environ.get('WORKSPACE')
+        workspace_loc = workspace_loc or os.environ.get('WORKSPACE')
 
         errata = ConfigParser.SafeConfigParser()
         ipa_conf_loc = os.path.join(workspace_loc, "nexus/etc/ipa.conf")
@@ -29,9 +36,7 @@ class Errata():
         self.download_loc = xmlrpc.get('xmlrpc-info', 'download_loc')
         self.mount_base = xmlrpc.get('xmlrpc-info', 'mount_base')
 
-        try:
-            self.xmlrpc_url and self.errata_id
-        except NameError:
+        if not (self.xmlrpc_url and self.errata_id):
             print "xmlrpc_url or errata_id is not defined"
 
     def getPackagesURL(self):
@@ -46,26 +51,39 @@ class Errata():
         response = set(response)
         return response
 
-    def dlPackages(self):
-        """ Download packages attached to Errata """
-        url = self.getPackagesURL()
+    def dlPackages(self, location='.', rpm_cache_dir=None,
+                   max_workers=DEFAULT_MAX_WORKERS):
+        """ Download packages attached to Errata into location, streamed to
+        disk on at most max_workers connections. Returns the Downloads. """
+        downloads = [Download(rpm_url, os.path.join(location, os.path.basename(rpm_url)))
+                     for rpm_url in sorted(self.getPackagesURL())]
+        rpm_cache = RPMCache(rpm_cache_dir) if rpm_cache_dir else None
+        Downloader(max_workers, cache=rpm_cache).fetch_all(downloads)
+        for download in downloads:
+            print("Downloading: {0} Bytes: {1}".format(download.url,
+                                                       os.path.getsize(download.dest)))
+            print(download.dest)
+        return downloads
 
-        for rpm_url in url:
-            print rpm_url
-            rpm_name = os.path.basename(rpm_url)
-            print rpm_name
-            u = urllib2.urlopen(rpm_url)
-            f = open(rpm_name, 'wb')
-            f.write(u.read())
-            f.close()
-            meta = u.info()
-            file_size = int(meta.getheaders("Content-Length")[0])
-            print("Downloading: {0} Bytes: {1}".format(rpm_url, file_size))
-            print(rpm_name)
+def create_parser():
+    parser = argparse.ArgumentParser(description='Downloads the builds \
+                                     attached to an erratum.')
+    parser.add_argument('--errata-id', help='Errata id. Defaults to the \
+                        errata_id environment variable')
+    parser.add_argument('--workspace', help='Jenkins workspace holding \
+                        nexus/etc/ipa.conf. Defaults to WORKSPACE')
+    parser.add_argument('--location', default='.', help='Download to \
+                        directory. Defaults to the current directory')
+    parser.add_argument('--rpm-cache-dir', help='Directory to cache rpms in \
+                        between runs')
+    parser.add_argument('--workers', type=int, default=DEFAULT_MAX_WORKERS,
+                        help='Number of parallel downloads')
+    return parser
 
-def main():
-    errata = Errata()
-    errata.dlPackages()
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    errata = Errata(args.errata_id, args.workspace)
+    errata.dlPackages(args.location, args.rpm_cache_dir, args.workers)
 
 if __name__ == '__main__':
     main()
@@ -18,7 +18,6 @@ setup(
     scripts=['bin/nexus'],
     install_requires=[
         'pbr',
-        'wget',
         'glob2',
         'paramiko',
         'argparse',